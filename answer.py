@@ -6,10 +6,15 @@ Run this after ingest.py:
 """
 
 import os
+import time
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-import chromadb
-from openai import OpenAI
+from onnx_encoder import load_query_encoder
+from llm_client import get_client, get_async_client
+from embedding_cache import encode_queries, query_cache
+from numpy_index import load_backend
+from source_text import chunk_text
+from metrics import span
+from config import EMBEDDING_MODEL
 
 # Load environment variables
 load_dotenv()
@@ -28,46 +33,71 @@ TOP_K = 5  # Number of chunks to retrieve
 # ============================================================
 
 def load_vector_store():
-    """Load the existing ChromaDB collection."""
+    """Load the existing ChromaDB collection (or an in-memory copy, see RETRIEVAL_BACKEND)."""
+    # Imported here: app.py imports this module before it opens ChromaDB itself,
+    # and the chromadb import must stay in that stage, overlapped with the model load
+    import chromadb
     client = chromadb.PersistentClient(path=CHROMA_PATH)
     collection = client.get_collection(name=COLLECTION_NAME)
-    return collection
+    return load_backend(collection)
 
 
 # ============================================================
 # STEP 2: RETRIEVE RELEVANT CHUNKS
 # ============================================================
 
-def retrieve(question, collection, embedding_model, top_k=TOP_K):
-    """Find the most relevant chunks for a question."""
+def retrieve_many(questions, collection, embedding_model, top_k=TOP_K, trace=None, return_embeddings=False):
+    """Find the most relevant chunks for several questions in one batch.
 
-    # Embed the question
-    question_embedding = embedding_model.encode(question).tolist()
+    Returns one chunk list per question, in the same order. With
+    return_embeddings=True, returns (chunk lists, question embeddings) so
+    callers can reuse the embeddings (e.g. for the answer cache).
+    """
 
-    # Search ChromaDB
-    results = collection.query(
-        query_embeddings=[question_embedding],
-        n_results=top_k
-    )
+    # Embed all questions in one forward pass (repeated questions come from the LRU cache)
+    with span(trace, "embed"):
+        question_embeddings = encode_queries(embedding_model, questions, EMBEDDING_MODEL)
+
+    # Search ChromaDB with every question at once
+    with span(trace, "search"):
+        results = collection.query(
+            query_embeddings=[embedding.tolist() for embedding in question_embeddings],
+            query_texts=list(questions),  # used for BM25 keyword matching in hybrid search
+            n_results=top_k
+        )
 
     # Extract chunks and metadata
-    retrieved_chunks = []
-    for i in range(len(results["documents"][0])):
-        retrieved_chunks.append({
-            "text": results["documents"][0][i],
-            "filename": results["metadatas"][0][i]["filename"],
-            "distance": results["distances"][0][i]
-        })
+    all_chunks = []
+    for q in range(len(questions)):
+        retrieved_chunks = []
+        for i in range(len(results["documents"][q])):
+            metadata = results["metadatas"][q][i]
+            retrieved_chunks.append({
+                "id": results["ids"][q][i],
+                "text": chunk_text(results["documents"][q][i], metadata),
+                "filename": metadata["filename"],
+                "heading": metadata.get("heading", ""),
+                "lines": (metadata["line_start"], metadata["line_end"]) if "line_start" in metadata else None,
+                "distance": results["distances"][q][i]
+            })
+        all_chunks.append(retrieved_chunks)
+
+    if return_embeddings:
+        return all_chunks, question_embeddings
+    return all_chunks
 
-    return retrieved_chunks
+
+def retrieve(question, collection, embedding_model, top_k=TOP_K):
+    """Find the most relevant chunks for a question."""
+    return retrieve_many([question], collection, embedding_model, top_k)[0]
 
 
 # ============================================================
 # STEP 3: GENERATE ANSWER WITH LLM
 # ============================================================
 
-def generate_answer(question, chunks):
-    """Send question + context to OpenAI and get answer."""
+def answer_request(question, chunks, stream=False):
+    """Chat completion arguments for answering a question from retrieved chunks."""
 
     # Build context from retrieved chunks
     context = "\n\n---\n\n".join([chunk["text"] for chunk in chunks])
@@ -88,21 +118,110 @@ QUESTION: {question}
 
 ANSWER:"""
 
-    # Call OpenAI
-    client = OpenAI()
-    response = client.chat.completions.create(
+    return dict(
         model="gpt-4o-mini",
         messages=[
             {"role": "system", "content": "You are a helpful StayEasy customer support assistant. Answer questions directly and precisely, prioritizing the most specific facts from the provided context."},
             {"role": "user", "content": prompt}
         ],
         temperature=0.3,
-        max_tokens=500
+        max_tokens=500,
+        stream=stream,
+        # Streamed responses only report token usage when asked to
+        **({"stream_options": {"include_usage": True}} if stream else {}),
     )
 
+
+def generate_answer(question, chunks, stream=False, trace=None):
+    """Send question + context to OpenAI and get answer.
+
+    With stream=True, returns a generator that yields the answer token by token.
+    """
+    client = get_client()
+    started = time.perf_counter()
+    try:
+        response = client.chat.completions.create(**answer_request(question, chunks, stream))
+    except Exception as exc:
+        if trace is not None:
+            trace.record_error("llm", exc)
+        raise
+    if stream:
+        return stream_tokens(response, trace, started)
+    if trace is not None:
+        trace.record("llm", time.perf_counter() - started)
+        trace.record_usage(response.usage)
+    return response.choices[0].message.content
+
+
+def stream_tokens(response, trace=None, started=None):
+    """Yield the text deltas of a streamed chat completion.
+
+    With a trace, records time to first token ("llm_first_token"), total LLM
+    time ("llm") and the token usage sent in the final event.
+    """
+    started = started or time.perf_counter()
+    first_token = True
+    try:
+        for event in response:
+            if trace is not None and event.usage is not None:
+                trace.record_usage(event.usage)
+            if event.choices and event.choices[0].delta.content:
+                if first_token and trace is not None:
+                    trace.record("llm_first_token", time.perf_counter() - started)
+                first_token = False
+                yield event.choices[0].delta.content
+    except Exception as exc:
+        if trace is not None:
+            trace.record_error("llm", exc)
+        raise
+    finally:
+        if trace is not None:
+            trace.record("llm", time.perf_counter() - started)
+
+
+async def generate_answer_async(question, chunks, stream=False, trace=None):
+    """generate_answer() on the AsyncOpenAI client, so waiting for the LLM blocks no thread.
+
+    With stream=True, returns an async generator that yields the answer token by token.
+    """
+    client = get_async_client()
+    started = time.perf_counter()
+    try:
+        response = await client.chat.completions.create(**answer_request(question, chunks, stream))
+    except Exception as exc:
+        if trace is not None:
+            trace.record_error("llm", exc)
+        raise
+    if stream:
+        return stream_tokens_async(response, trace, started)
+    if trace is not None:
+        trace.record("llm", time.perf_counter() - started)
+        trace.record_usage(response.usage)
     return response.choices[0].message.content
 
 
+async def stream_tokens_async(response, trace=None, started=None):
+    """stream_tokens() for an async streamed chat completion."""
+    started = started or time.perf_counter()
+    first_token = True
+    try:
+        async for event in response:
+            if trace is not None and event.usage is not None:
+                trace.record_usage(event.usage)
+            if event.choices and event.choices[0].delta.content:
+                if first_token and trace is not None:
+                    trace.record("llm_first_token", time.perf_counter() - started)
+                first_token = False
+                yield event.choices[0].delta.content
+    except Exception as exc:
+        if trace is not None:
+            trace.record_error("llm", exc)
+        raise
+    finally:
+        if trace is not None:
+            trace.record("llm", time.perf_counter() - started)
+
+
 # ============================================================
 # STEP 4: RAG PIPELINE (RETRIEVE + GENERATE)
 # ============================================================
@@ -122,6 +241,8 @@ def ask(question, collection, embedding_model):
     print(f"\nFound {len(chunks)} relevant chunks:")
     for i, chunk in enumerate(chunks):
         print(f"  {i+1}. {chunk['filename']} (distance: {chunk['distance']:.4f})")
+    stats = query_cache.stats()
+    print(f"  Query embedding cache: {stats['hits']} hits, {stats['misses']} misses")
 
     # Generate answer
     print("\n[Generating answer...]")
@@ -141,9 +262,10 @@ def main():
     print("=" * 50)
     print("Type 'quit' to exit.\n")
 
-    # Load embedding model
+    # Load embedding model (imported here: torch is slow to import and api.py only needs the functions above)
+    from sentence_transformers import SentenceTransformer
     print("Loading embedding model...")
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+    embedding_model = load_query_encoder(SentenceTransformer(EMBEDDING_MODEL))
 
     # Load vector store
     print("Loading vector database...")
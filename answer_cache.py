@@ -0,0 +1,208 @@
+"""
+answer_cache.py - Semantic cache of generated answers
+
+If a new question is close enough (cosine similarity) to one answered before
+AND retrieval returned the same chunks, the stored answer is reused instead
+of calling the LLM again.
+
+The cache is saved to disk and tied to the collection's "index_version"
+(written by ingest.py), so re-ingesting different content invalidates it,
+both on load and, through check_index_version(), while the app is running.
+store() only marks the cache dirty; the file is rewritten at most once per
+ANSWER_CACHE_FLUSH_SECONDS by a background timer, and once more at exit.
+
+Settings (environment variables):
+    ANSWER_CACHE_PATH            JSON file the cache is persisted to (default answer_cache.json)
+    ANSWER_CACHE_THRESHOLD       minimum cosine similarity for a hit (default 0.95)
+    ANSWER_CACHE_SIZE            max stored answers, oldest dropped first (default 1000)
+    ANSWER_CACHE_FLUSH_SECONDS   how long new answers wait before being written (default 5)
+"""
+
+import os
+import json
+import uuid
+import atexit
+import threading
+import numpy as np
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.json")
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+FLUSH_SECONDS = float(os.getenv("ANSWER_CACHE_FLUSH_SECONDS", "5"))
+
+
+# ============================================================
+# CACHE
+# ============================================================
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """Answers keyed on (question embedding, retrieved chunk IDs)."""
+
+    def __init__(self, path=ANSWER_CACHE_PATH, index_version="",
+                 threshold=SIMILARITY_THRESHOLD, max_entries=MAX_ENTRIES, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.index_version = index_version
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.flush_seconds = flush_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = []        # [{"question", "chunk_ids", "answer"}]
+        self._embeddings = None   # (capacity, dim) float32; row i is the unit vector of entry i
+        self._oldest = 0          # once full, entries are overwritten in place starting here
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer at a time; lookups never wait on disk
+        self._dirty = False
+        self._timer = None
+        self._load()
+        if self.path:
+            atexit.register(self.flush)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get("index_version") != self.index_version:
+            print("Answer cache belongs to a different ingest, starting empty")
+            return
+        self._entries = data.get("entries", [])[-self.max_entries:] if self.max_entries > 0 else []
+        if self._entries:
+            self._embeddings = np.array([entry.pop("embedding") for entry in self._entries], dtype=np.float32)
+        print(f"Loaded {len(self._entries)} cached answers")
+
+    def save(self):
+        """Write the cache to disk now."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                self._dirty = False
+                # Oldest first, so the file reloads in the order entries are evicted
+                order = list(range(self._oldest, len(self._entries))) + list(range(self._oldest))
+                entries = [{**self._entries[i], "embedding": self._embeddings[i].tolist()} for i in order]
+                data = {"index_version": self.index_version, "entries": entries}
+            # Unique temp name, so a writer in another process never renames ours
+            tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                with self._lock:
+                    self._dirty = True  # try again on the next flush
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def flush(self):
+        """Write the cache if anything was stored since the last save."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            dirty = self._dirty
+        if dirty:
+            self.save()
+
+    def _schedule_flush(self):
+        # Called with self._lock held
+        if self.path:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_seconds, self._flush_later)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_later(self):
+        try:
+            self.flush()
+        except OSError as exc:
+            print(f"Could not save the answer cache to {self.path}: {exc}")
+
+    def lookup(self, question_embedding, chunk_ids):
+        """Return a stored answer for a near-identical question with the same context, else None."""
+        query = _normalize(question_embedding)
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            if self._entries:
+                similarities = self._embeddings[:len(self._entries)] @ query
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    if self._entries[i]["chunk_ids"] == chunk_ids:
+                        self.hits += 1
+                        return self._entries[i]["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, question, question_embedding, chunk_ids, answer):
+        """Remember an answer; it is written to disk by the next scheduled flush."""
+        if self.max_entries <= 0:
+            return
+        vector = _normalize(question_embedding)
+        entry = {"question": question, "chunk_ids": list(chunk_ids), "answer": answer}
+        with self._lock:
+            n = len(self._entries)
+            if n >= self.max_entries:
+                # Full: the new entry takes the oldest one's slot, nothing is shifted
+                slot = self._oldest
+                self._oldest = (slot + 1) % n
+                self._entries[slot] = entry
+            else:
+                if self._embeddings is None or n == len(self._embeddings):
+                    # Grow by doubling, so filling the cache copies each row O(1) times on average
+                    capacity = min(self.max_entries, max(16, 2 * n))
+                    grown = np.empty((capacity, len(vector)), dtype=np.float32)
+                    if n:
+                        grown[:n] = self._embeddings[:n]
+                    self._embeddings = grown
+                slot = n
+                self._entries.append(entry)
+            self._embeddings[slot] = vector
+            self._schedule_flush()
+
+    def check_index_version(self, index_version):
+        """Drop every entry if the collection was re-ingested since they were stored.
+
+        Chunk IDs are filename_position, so they survive a content edit; the
+        index_version is what tells the old answers apart. Returns True if the
+        cache was cleared.
+        """
+        with self._lock:
+            if index_version == self.index_version:
+                return False
+            self.index_version = index_version
+            self._entries = []
+            self._embeddings = None
+            self._oldest = 0
+            self._schedule_flush()
+        print("Collection was re-ingested, cleared the answer cache")
+        return True
+
+    def clear(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._entries = []
+            self._embeddings = None
+            self._oldest = 0
+        self.save()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
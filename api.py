@@ -0,0 +1,360 @@
+"""
+api.py - JSON HTTP API for retrieval and answers
+
+A small FastAPI service for integrations (the website widget, the ticketing
+system) that need answers without going through the Gradio UI. It uses the
+same retrieval and prompt as answer.py.
+
+    POST /retrieve   {"question": "...", "top_k": 5}                  -> ranked chunks
+    POST /answer     {"question": "...", "top_k": 5, "stream": false}  -> answer + sources
+                     with "stream": true the answer arrives as server-sent events:
+                     one "sources" event, "token" events, then "done" (or "error")
+    POST /batch      {"questions": ["...", ...], "answer": false}     -> one result per question,
+                     retrieved with one encode and one vector search
+    GET  /healthz    200 while the process is up
+    GET  /readyz     200 once the model and index are loaded, 503 before (or if loading failed)
+
+The model and index load in the background, so /healthz answers right away
+and /readyz tells a load balancer when to start sending traffic. Retrieval
+runs in a bounded thread pool and the LLM call uses the async OpenAI client.
+
+Run:
+    python api.py                       # http://localhost:8000 (docs at /docs)
+    API_MOUNT_GRADIO=1 python api.py    # also serve the Gradio UI at /ui
+
+Multi-worker mode (one process per core, all sharing one copy of the index):
+    python ingest.py --export-index float32   # or int8 / --pca; once per ingest
+    python api.py --workers 4
+
+Each worker loads its own query encoder but opens the exported index
+read-only and memory-mapped (see numpy_index.py), as is the BM25 index
+(see bm25_index.py), so the vectors, chunk records and keyword postings live
+once in the OS page cache and no worker opens ChromaDB. Every
+worker gets CPUs / workers threads for PyTorch, ONNX Runtime and BLAS, so
+workers do not fight over cores. /readyz reports each worker's pid and
+peak RSS.
+
+    curl -s localhost:8000/answer -H 'Content-Type: application/json' \\
+         -d '{"question": "What is the guest service fee?"}'
+
+Settings (environment variables):
+    API_HOST            interface to listen on (default 127.0.0.1)
+    API_PORT            port (default 8000)
+    API_MAX_BATCH       most questions accepted by /batch (default 32)
+    API_MOUNT_GRADIO    "1" to mount the Gradio UI from app.py at /ui (default "0")
+    API_WORKERS         worker processes (default 1, same as --workers)
+    TORCH_THREADS       PyTorch threads per process (default: CPUs / workers with --workers)
+    RETRIEVAL_THREADS   threads for embedding and search (default min(8, CPUs))
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import List, Optional
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from metrics import Trace, start_metrics_server
+from config import EMBEDDING_MODEL
+
+load_dotenv()
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+TOP_K = 5
+MAX_TOP_K = 50
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+MAX_BATCH = int(os.getenv("API_MAX_BATCH", "32"))
+MOUNT_GRADIO = os.getenv("API_MOUNT_GRADIO", "0") == "1"
+WORKERS = int(os.getenv("API_WORKERS", "1"))
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", str(min(8, os.cpu_count() or 1))))
+
+
+# ============================================================
+# MODEL AND INDEX (loaded in the background)
+# ============================================================
+
+class ServiceState:
+    """What /readyz reports: "loading", "ready" or "failed", plus the loaded objects."""
+
+    def __init__(self):
+        self.status = "loading"
+        self.error = None
+        self.collection = None
+        self.encoder = None
+        self.load_seconds = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def load(self, gradio_app=None):
+        """Load the query encoder and the retrieval backend; gradio_app shares app.py's instead."""
+        try:
+            if gradio_app is not None:
+                collection, encoder = gradio_app.collection, gradio_app.query_encoder
+            else:
+                from sentence_transformers import SentenceTransformer
+                from onnx_encoder import load_query_encoder
+                from micro_batcher import batched_encoder
+                from numpy_index import load_backend, RETRIEVAL_BACKEND
+                from answer import load_vector_store
+
+                if TORCH_THREADS:
+                    set_torch_threads(TORCH_THREADS)
+                print("Loading embedding model...")
+                encoder = batched_encoder(load_query_encoder(SentenceTransformer(EMBEDDING_MODEL)))
+                print("Loading vector database...")
+                # The exported index is opened directly; only the other backends need ChromaDB
+                collection = load_backend(None, "compact") if RETRIEVAL_BACKEND == "compact" else load_vector_store()
+            with self._lock:
+                self.collection, self.encoder = collection, encoder
+                self.load_seconds = time.perf_counter() - self._started
+                self.status = "ready"
+            print(f"API ready: {collection.count()} chunks loaded in {self.load_seconds:.1f}s")
+        except Exception as exc:
+            with self._lock:
+                self.status = "failed"
+                self.error = f"{type(exc).__name__}: {exc}"
+            print(f"API failed to load: {self.error}")
+
+    def info(self):
+        return {
+            "pid": os.getpid(),
+            # ru_maxrss is KB on Linux
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+    def require_ready(self):
+        if self.status != "ready":
+            raise HTTPException(status_code=503, detail=f"Service is {self.status}")
+        return self.collection, self.encoder
+
+
+# ============================================================
+# REQUEST / RESPONSE BODIES
+# ============================================================
+
+class RetrieveRequest(BaseModel):
+    question: str = Field(min_length=1)
+    top_k: int = Field(default=TOP_K, ge=1, le=MAX_TOP_K)
+
+
+class AnswerRequest(RetrieveRequest):
+    stream: bool = False
+
+
+class BatchRequest(BaseModel):
+    questions: List[str] = Field(min_length=1)
+    top_k: int = Field(default=TOP_K, ge=1, le=MAX_TOP_K)
+    answer: bool = False  # also generate an answer for every question
+
+
+class Source(BaseModel):
+    id: str
+    filename: str
+    heading: str
+    lines: Optional[List[int]]
+    distance: float
+    text: Optional[str] = None
+
+
+def sources(chunks, include_text=False):
+    """Chunk dicts from answer.retrieve_many() as response objects."""
+    return [
+        Source(
+            id=chunk["id"], filename=chunk["filename"], heading=chunk["heading"],
+            lines=list(chunk["lines"]) if chunk["lines"] else None, distance=chunk["distance"],
+            text=chunk["text"] if include_text else None,
+        ).model_dump(exclude=None if include_text else {"text"})
+        for chunk in chunks
+    ]
+
+
+# ============================================================
+# HANDLERS
+# ============================================================
+
+def create_api(mount_gradio=MOUNT_GRADIO):
+    """Build the FastAPI app; with mount_gradio the Gradio UI is served at /ui and shares its model."""
+    from answer import retrieve_many, generate_answer_async
+
+    state = ServiceState()
+    retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieve")
+    gradio_app = None
+
+    @asynccontextmanager
+    async def lifespan(api):
+        threading.Thread(target=state.load, args=(gradio_app,), daemon=True).start()
+        yield
+
+    api = FastAPI(title="StayEasy RAG API", lifespan=lifespan)
+    if mount_gradio:
+        import gradio as gr
+        import app as gradio_app  # loads the model and index while importing
+        api = gr.mount_gradio_app(api, gradio_app.demo, path="/ui")
+    api.state.service = state
+
+    async def retrieve_async(questions, top_k, trace):
+        collection, encoder = state.require_ready()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            retrieval_pool, partial(retrieve_many, questions, collection, encoder, top_k, trace=trace)
+        )
+
+    async def complete(question, chunks, trace):
+        try:
+            return await generate_answer_async(question, chunks, trace=trace)
+        except Exception as exc:
+            raise HTTPException(status_code=502, detail=f"LLM request failed: {type(exc).__name__}")
+
+    @api.get("/healthz")
+    def healthz():
+        return {"status": "ok"}
+
+    @api.get("/readyz")
+    def readyz():
+        body = {"status": state.status}
+        if state.status == "ready":
+            body.update({
+                "chunks": state.collection.count(),
+                "index_version": (state.collection.metadata or {}).get("index_version", ""),
+                "load_seconds": round(state.load_seconds, 2),
+                **state.info(),
+            })
+        elif state.error:
+            body["error"] = state.error
+        return JSONResponse(body, status_code=200 if state.status == "ready" else 503)
+
+    @api.post("/retrieve")
+    async def retrieve_endpoint(request: RetrieveRequest):
+        trace = Trace("api_retrieve")
+        try:
+            chunks = (await retrieve_async([request.question], request.top_k, trace))[0]
+            return {"question": request.question, "chunks": sources(chunks, include_text=True)}
+        finally:
+            trace.finish()
+
+    @api.post("/answer")
+    async def answer_endpoint(request: AnswerRequest):
+        trace = Trace("api_answer")
+        try:
+            chunks = (await retrieve_async([request.question], request.top_k, trace))[0]
+        except BaseException:
+            trace.finish()
+            raise
+        if request.stream:
+            return StreamingResponse(stream_answer(request.question, chunks, trace), media_type="text/event-stream")
+        try:
+            answer = await complete(request.question, chunks, trace)
+            return {"question": request.question, "answer": answer, "sources": sources(chunks)}
+        finally:
+            trace.finish()
+
+    async def stream_answer(question, chunks, trace):
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+        yield event("sources", sources(chunks))
+        try:
+            # Timing, usage and the "llm" error are recorded on the trace by answer.py
+            async for token in await generate_answer_async(question, chunks, stream=True, trace=trace):
+                yield event("token", {"text": token})
+            yield event("done", {})
+        except Exception as exc:
+            # The 200 status is already sent, so the failure is reported in the stream
+            yield event("error", {"detail": f"LLM request failed: {type(exc).__name__}"})
+        finally:
+            trace.finish()
+
+    @api.post("/batch")
+    async def batch_endpoint(request: BatchRequest):
+        if len(request.questions) > MAX_BATCH:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH} questions per batch")
+        trace = Trace("api_batch")
+        try:
+            all_chunks = await retrieve_async(request.questions, request.top_k, trace)
+            results = [{"question": q, "sources": sources(chunks)} for q, chunks in zip(request.questions, all_chunks)]
+            if request.answer:
+                # Answers are generated concurrently; one failure fails only its own entry
+                answers = await asyncio.gather(
+                    *(complete(q, chunks, trace) for q, chunks in zip(request.questions, all_chunks)),
+                    return_exceptions=True,
+                )
+                for result, answer in zip(results, answers):
+                    if isinstance(answer, HTTPException):
+                        result["error"] = answer.detail
+                    elif isinstance(answer, BaseException):
+                        raise answer
+                    else:
+                        result["answer"] = answer
+            return {"results": results}
+        finally:
+            trace.finish(questions=len(request.questions))
+
+    return api
+
+
+api = create_api()
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def set_torch_threads(n_threads):
+    """Limit PyTorch's intra-op threads in this process (no-op without PyTorch)."""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(n_threads)
+
+
+def configure_workers(workers):
+    """Environment for worker processes: a share of the cores each and the shared index.
+
+    Set before uvicorn starts the workers, which inherit it.
+    """
+    threads = str(max(1, (os.cpu_count() or 1) // workers))
+    for name in ("TORCH_THREADS", "ONNX_THREADS", "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(name, threads)
+    os.environ.setdefault("RETRIEVAL_BACKEND", "compact")
+    if os.environ["RETRIEVAL_BACKEND"] != "compact":
+        print(f"Warning: RETRIEVAL_BACKEND={os.environ['RETRIEVAL_BACKEND']} gives every worker its own index copy")
+    else:
+        from numpy_index import INDEX_DIR
+        if not os.path.exists(os.path.join(INDEX_DIR, "index.json")):
+            raise SystemExit(f"No exported index in {INDEX_DIR}/ (run: python ingest.py --export-index float32)")
+    print(f"Starting {workers} workers, {threads} threads each, sharing the index in memory-mapped files")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="StayEasy RAG JSON API")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes sharing one mmapped index")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        configure_workers(args.workers)
+        # Each worker has its own metrics registry, so one shared port would only show one of them
+        print("Metrics endpoint is disabled with several workers")
+        uvicorn.run("api:api", host=API_HOST, port=API_PORT, workers=args.workers)
+    else:
+        start_metrics_server()
+        uvicorn.run(api, host=API_HOST, port=API_PORT)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,43 @@ app.py - Gradio UI for StayEasy RAG system
 
 Run:
     python app.py
+
+Per-stage latency and token metrics are served at http://localhost:9100/metrics
+(see metrics.py), and each chat request is logged as one JSON line.
+
+Startup loads the embedding model once (in the background while gradio is
+imported), opens a single ChromaDB client, and prints a timing breakdown.
+
+The chat handler is async: retrieval runs in a small thread pool and the
+OpenAI call uses the async client, so one process serves many chats at once.
+
+Settings (environment variables):
+    CHAT_CONCURRENCY    chats handled at the same time (default 40)
+    CHAT_QUEUE_SIZE     chats allowed to wait for a slot, 0 = no limit (default 0)
+    RETRIEVAL_THREADS   threads for embedding and search (default min(8, CPUs))
+    MICRO_BATCH         "1" (default) to batch concurrent query embeddings (see micro_batcher.py)
+    STREAM_ANSWERS      "1" (default) to stream answers token by token
 """
 
 import os
 import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-import chromadb
-from openai import OpenAI
-import gradio as gr
+from llm_client import get_client, get_async_client
+from embedding_cache import query_cache
+from answer_cache import SemanticAnswerCache
+from eval_runner import run_cases
+from numpy_index import load_backend
+from onnx_encoder import load_query_encoder
+from micro_batcher import MicroBatcher, batched_encoder
+from answer import generate_answer, generate_answer_async, retrieve_many as retrieve_chunks
+from metrics import Trace, registry, start_metrics_server
+from config import EMBEDDING_MODEL
 
 load_dotenv()
 
@@ -23,142 +51,283 @@ CHROMA_PATH = "chroma_db"
 COLLECTION_NAME = "stayeasy_docs"
 TOP_K = 5
 DATA_FOLDER = "data"
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") != "0"  # stream chat answers token by token
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "40"))   # chats in flight at once
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "0"))      # chats allowed to wait (0 = no limit)
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", str(min(8, os.cpu_count() or 1))))
+INDEX_VERSION_CHECK_SECONDS = 1.0  # how often the answer cache checks for a re-ingest
 
 # ============================================================
-# AUTO-INGEST: build vector DB at startup if not present
+# STARTUP TIMING
 # ============================================================
 
-def build_vector_db():
-    from pathlib import Path
-    print("Building vector database from documents...")
-    embedding_model_tmp = SentenceTransformer("all-MiniLM-L6-v2")
-    client_tmp = chromadb.PersistentClient(path=CHROMA_PATH)
+STARTUP_TIMINGS = {}
+_startup_began = time.perf_counter()
+
+
+@contextmanager
+def startup_stage(name):
+    """Time one step of app startup for the breakdown printed once the app is ready."""
+    start = time.perf_counter()
     try:
-        client_tmp.delete_collection(COLLECTION_NAME)
-    except Exception:
-        pass
-    collection_tmp = client_tmp.create_collection(name=COLLECTION_NAME)
-
-    chunks = []
-    for file_path in Path(DATA_FOLDER).glob("*.md"):
-        content = file_path.read_text(encoding="utf-8")
-        # simple paragraph chunking
-        paragraphs = [p.strip() for p in content.split("\n\n") if p.strip()]
-        for i, para in enumerate(paragraphs):
-            chunks.append({"text": para, "filename": file_path.name, "chunk_id": str(i), "heading": ""})
-
-    texts = [c["text"] for c in chunks]
-    ids = [f"{c['filename']}_{c['chunk_id']}" for c in chunks]
-    metadatas = [{"filename": c["filename"], "chunk_id": c["chunk_id"], "heading": c["heading"]} for c in chunks]
-    embeddings = embedding_model_tmp.encode(texts).tolist()
-    collection_tmp.add(documents=texts, embeddings=embeddings, ids=ids, metadatas=metadatas)
-    print(f"Built vector DB with {len(chunks)} chunks.")
-
-chroma_client_check = chromadb.PersistentClient(path=CHROMA_PATH)
-try:
-    col_check = chroma_client_check.get_collection(COLLECTION_NAME)
-    if col_check.count() == 0:
-        raise Exception("empty")
-except Exception:
-    build_vector_db()
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = time.perf_counter() - start
+
 
 # ============================================================
-# LOAD MODELS (once at startup)
+# LOAD MODEL (once, in the background)
 # ============================================================
 
-print("Loading embedding model...")
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+def load_embedding_model():
+    """Import sentence-transformers (pulls in torch) and load the model."""
+    with startup_stage("import sentence_transformers"):
+        from sentence_transformers import SentenceTransformer
+    with startup_stage("load embedding model"):
+        return SentenceTransformer(EMBEDDING_MODEL)
 
-print("Loading vector database...")
-chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-collection = chroma_client.get_collection(name=COLLECTION_NAME)
-print(f"Loaded {collection.count()} chunks")
 
+# The model is the slowest thing to load, so start it first and let the
+# gradio import and ChromaDB open happen while it loads.
+print("Loading embedding model...")
+_model_future = ThreadPoolExecutor(max_workers=1).submit(load_embedding_model)
+
+with startup_stage("import gradio"):
+    import gradio as gr
 
 # ============================================================
-# RAG FUNCTIONS
+# OPEN VECTOR DATABASE (one client for the whole app)
 # ============================================================
 
-def retrieve(question, top_k=TOP_K):
-    """Find the most relevant chunks for a question."""
-    question_embedding = embedding_model.encode(question).tolist()
-    results = collection.query(
-        query_embeddings=[question_embedding],
-        n_results=top_k,
-    )
-    chunks = []
-    for i in range(len(results["documents"][0])):
-        chunks.append({
-            "text": results["documents"][0][i],
-            "filename": results["metadatas"][0][i]["filename"],
-            "heading": results["metadatas"][0][i].get("heading", ""),
-            "distance": results["distances"][0][i],
-        })
-    return chunks
+with startup_stage("open chromadb"):
+    import chromadb
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    try:
+        raw_collection = chroma_client.get_collection(name=COLLECTION_NAME)
+    except Exception:
+        raw_collection = None
 
+embedding_model = _model_future.result()
 
-def generate_answer(question, chunks):
-    """Send question + context to OpenAI and get answer."""
-    context = "\n\n---\n\n".join([chunk["text"] for chunk in chunks])
 
-    prompt = f"""You are a helpful customer support assistant for StayEasy, a vacation rental platform.
+def build_vector_db():
+    """Auto-ingest: run the ingest.py pipeline with the already-loaded model and client."""
+    import ingest
+    print("Building vector database from documents...")
+    chunks = ingest.iter_chunks(ingest.iter_documents(DATA_FOLDER))
+    return ingest.create_vector_store(chunks, client=chroma_client, embedding_model=embedding_model)
 
-INSTRUCTIONS:
-- Answer the question based ONLY on the context provided below.
-- Be specific and direct. Lead with the most important fact that answers the question.
-- Include specific numbers, timeframes, and requirements from the context.
-- If the answer is not in the context, say "I don't have information about that."
 
-CONTEXT:
-{context}
+if raw_collection is None or raw_collection.count() == 0:
+    with startup_stage("build vector db"):
+        raw_collection = build_vector_db()
 
-QUESTION: {question}
+print("Loading vector database...")
+with startup_stage("load retrieval backend"):
+    collection = load_backend(raw_collection)
+print(f"Loaded {collection.count()} chunks")
 
-ANSWER:"""
+# Questions go through ONNX Runtime when QUERY_ENCODER=onnx / onnx-int8 (see onnx_encoder.py);
+# the PyTorch model is still used for ingest and the parity check.
+with startup_stage("load query encoder"):
+    query_encoder = load_query_encoder(embedding_model)
+# Questions from concurrent chats share one forward pass (MICRO_BATCH, see micro_batcher.py)
+query_encoder = batched_encoder(query_encoder)
 
-    client = OpenAI()
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a helpful StayEasy customer support assistant. Answer questions directly and precisely, prioritizing the most specific facts from the provided context."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.3,
-        max_tokens=500,
-    )
-    return response.choices[0].message.content
+# Answers are reused for near-identical questions with the same retrieved chunks
+answer_cache = SemanticAnswerCache(index_version=(raw_collection.metadata or {}).get("index_version", ""))
+
+registry.register_gauge("stayeasy_query_cache", "Query embedding cache counters", query_cache.stats)
+registry.register_gauge("stayeasy_answer_cache", "Semantic answer cache counters", answer_cache.stats)
+if isinstance(query_encoder, MicroBatcher):
+    registry.register_gauge("stayeasy_micro_batcher", "Query embedding batch counters", query_encoder.stats)
+
+# Embedding and search are CPU-bound and run here, off the event loop; the pool
+# size bounds how many run at once no matter how many chats are in flight.
+retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieve")
+# New answers go to the answer cache through a single writer thread, in order
+answer_cache_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-cache")
 
 
 # ============================================================
-# CHAT TAB
+# RAG FUNCTIONS
 # ============================================================
 
-def chat_respond(message, history):
-    """Handle a chat message: retrieve chunks, generate answer, return sources separately."""
-    if not message.strip():
-        return "", history, ""
+def retrieve_many(questions, top_k=TOP_K, trace=None):
+    """Find the most relevant chunks for several questions with one encode and one query.
 
-    # Retrieve relevant chunks
-    chunks = retrieve(message)
+    Returns one chunk list per question, in the same order.
+    """
+    return retrieve_chunks(questions, collection, query_encoder, top_k, trace=trace)
+
+
+def retrieve(question, top_k=TOP_K, trace=None):
+    """Find the most relevant chunks for a question."""
+    return retrieve_many([question], top_k, trace)[0]
+
+
+def retrieve_with_embedding(question, top_k=TOP_K, trace=None):
+    """retrieve() that also returns the question embedding, for the answer cache."""
+    all_chunks, embeddings = retrieve_chunks([question], collection, query_encoder, top_k,
+                                             trace=trace, return_embeddings=True)
+    return all_chunks[0], embeddings[0]
 
-    # Generate answer
-    answer = generate_answer(message, chunks)
 
-    # Build sources panel (shown on the right)
+# ============================================================
+# CHAT TAB
+# ============================================================
+
+def format_sources(chunks):
+    """Build the sources panel (shown on the right)."""
     sources = []
     for i, chunk in enumerate(chunks):
+        lines = chunk.get("lines")
+        location = f" (lines {lines[0]}-{lines[1]})" if lines else ""
         sources.append(
-            f"### {i+1}. {chunk['filename']}\n"
+            f"### {i+1}. {chunk['filename']}{location}\n"
             f"**Section:** {chunk['heading']}\n\n"
             f"**Distance:** {chunk['distance']:.4f}\n\n"
             f"```\n{chunk['text'][:300]}{'...' if len(chunk['text']) > 300 else ''}\n```"
         )
-    sources_md = "\n\n---\n\n".join(sources)
+    return "\n\n---\n\n".join(sources)
+
+
+_index_version_checked_at = 0.0
+
+
+def check_index_version():
+    """Clear the answer cache if the collection has been re-ingested since it was filled.
+
+    The collection's index_version is read from ChromaDB at most once per
+    INDEX_VERSION_CHECK_SECONDS, so most chats skip the lookup.
+    """
+    global _index_version_checked_at
+    now = time.monotonic()
+    if now - _index_version_checked_at < INDEX_VERSION_CHECK_SECONDS:
+        return
+    _index_version_checked_at = now
+    try:
+        metadata = chroma_client.get_collection(name=COLLECTION_NAME).metadata or {}
+    except Exception:
+        return  # the collection is briefly missing while ingest.py --rebuild runs; check again later
+    answer_cache.check_index_version(metadata.get("index_version", ""))
+
+
+def lookup_cached_answer(question_embedding, chunks):
+    """Reuse a cached answer if a near-identical question retrieved the same chunks.
+
+    question_embedding is the one retrieve_with_embedding() just computed, so
+    the question is never encoded twice. Returns (chunk IDs, answer or None).
+    """
+    check_index_version()
+    chunk_ids = [chunk["id"] for chunk in chunks]
+    return chunk_ids, answer_cache.lookup(question_embedding, chunk_ids)
+
+
+def remember_answer(message, question_embedding, chunk_ids, answer):
+    """Add an answer to the answer cache; a failure is logged, never shown to the user."""
+    try:
+        answer_cache.store(message, question_embedding, chunk_ids, answer)
+    except Exception as exc:
+        print(f"Could not store answer in the answer cache: {type(exc).__name__}: {exc}")
+
+
+def chat_respond(message, history):
+    """Handle a chat message: retrieve chunks, generate answer, return sources separately.
+
+    This is a generator so Gradio can show the sources right after retrieval
+    and then fill in the answer as tokens arrive.
+    """
+    if not message.strip():
+        yield "", history, ""
+        return
+
+    trace = Trace("chat")
+    cache_hit = False
+    try:
+        # Retrieve relevant chunks and show the sources before the LLM call starts
+        chunks, question_embedding = retrieve_with_embedding(message, trace=trace)
+        sources_md = format_sources(chunks)
+
+        # Gradio 6.x uses messages format
+        history = history + [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": ""},
+        ]
+        yield "", history, sources_md
+
+        with trace.span("answer_cache"):
+            chunk_ids, answer = lookup_cached_answer(question_embedding, chunks)
+        cache_hit = answer is not None
+
+        # Generate answer
+        if answer is None:
+            if STREAM_ANSWERS:
+                answer = ""
+                for token in generate_answer(message, chunks, stream=True, trace=trace):
+                    answer += token
+                    history[-1] = {"role": "assistant", "content": answer}
+                    yield "", history, sources_md
+            else:
+                answer = generate_answer(message, chunks, trace=trace)
+            remember_answer(message, question_embedding, chunk_ids, answer)
+
+        history[-1] = {"role": "assistant", "content": answer}
+        yield "", history, sources_md
+    finally:
+        trace.finish(answer_cache_hit=cache_hit, question_chars=len(message))
+
+
+async def chat_respond_async(message, history):
+    """chat_respond() for the Gradio event loop.
+
+    Embedding, search and the answer cache lookup run in the bounded
+    retrieval_pool (the model itself is guarded by embedding_cache.model_lock),
+    new answers are stored by the single answer_cache_writer thread, and the LLM
+    call uses the async client, so a chat waiting on OpenAI holds no thread
+    and many chats can be in flight at once (see CHAT_CONCURRENCY).
+    """
+    if not message.strip():
+        yield "", history, ""
+        return
+
+    loop = asyncio.get_running_loop()
+    trace = Trace("chat")
+    cache_hit = False
+    try:
+        chunks, question_embedding = await loop.run_in_executor(
+            retrieval_pool, partial(retrieve_with_embedding, message, trace=trace)
+        )
+        sources_md = format_sources(chunks)
+
+        history = history + [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": ""},
+        ]
+        yield "", history, sources_md
 
-    # Gradio 6.x uses messages format
-    history.append({"role": "user", "content": message})
-    history.append({"role": "assistant", "content": answer})
-    return "", history, sources_md
+        with trace.span("answer_cache"):
+            chunk_ids, answer = await loop.run_in_executor(
+                retrieval_pool, lookup_cached_answer, question_embedding, chunks
+            )
+        cache_hit = answer is not None
+
+        if answer is None:
+            if STREAM_ANSWERS:
+                answer = ""
+                async for token in await generate_answer_async(message, chunks, stream=True, trace=trace):
+                    answer += token
+                    history[-1] = {"role": "assistant", "content": answer}
+                    yield "", history, sources_md
+            else:
+                answer = await generate_answer_async(message, chunks, trace=trace)
+            # Not awaited: the answer is already complete, storing it is bookkeeping
+            answer_cache_writer.submit(remember_answer, message, question_embedding, chunk_ids, answer)
+
+        history[-1] = {"role": "assistant", "content": answer}
+        yield "", history, sources_md
+    finally:
+        trace.finish(answer_cache_hit=cache_hit, question_chars=len(message))
 
 
 # ============================================================
@@ -243,7 +412,7 @@ Score these three metrics (1=worst, 5=best):
 Respond in this exact JSON format only, no other text:
 {{"answer_relevance": <1-5>, "answer_correctness": <1-5>, "faithfulness": <1-5>}}"""
 
-    client = OpenAI()
+    client = get_client()
     response = client.chat.completions.create(
         model="gpt-4o-mini",
         messages=[{"role": "user", "content": prompt}],
@@ -259,6 +428,27 @@ Respond in this exact JSON format only, no other text:
     return scores
 
 
+def evaluate_case(test, chunks):
+    """Generate and judge a single test case from its retrieved chunks."""
+    source_files = [c["filename"] for c in chunks]
+    hit = test["expected_source"] in source_files
+
+    # Compute reciprocal rank
+    if hit:
+        rank = source_files.index(test["expected_source"]) + 1
+        rr = 1.0 / rank
+    else:
+        rank = 0
+        rr = 0.0
+
+    # Generate answer
+    actual_answer = generate_answer(test["question"], chunks)
+
+    # Judge
+    scores = llm_judge(test["question"], test["expected_answer"], actual_answer, chunks)
+    return {"hit": hit, "rank": rank, "rr": rr, "answer": actual_answer, "scores": scores}
+
+
 def run_evaluation(progress=gr.Progress()):
     """Run the full evaluation and return results as markdown + dataframe."""
     results = []
@@ -269,27 +459,23 @@ def run_evaluation(progress=gr.Progress()):
     all_faithfulness = []
     total = len(TEST_CASES)
 
-    for i, test in enumerate(progress.tqdm(TEST_CASES, desc="Evaluating questions")):
-        # Retrieve
-        chunks = retrieve(test["question"])
-        source_files = [c["filename"] for c in chunks]
-        hit = test["expected_source"] in source_files
-        retrieval_hits += 1 if hit else 0
+    # Cases run concurrently (EVAL_CONCURRENCY); outcomes come back in TEST_CASES order
+    completed = []
+    progress(0, desc="Evaluating questions")
 
-        # Compute reciprocal rank
-        if hit:
-            rank = source_files.index(test["expected_source"]) + 1
-            rr = 1.0 / rank
-        else:
-            rank = 0
-            rr = 0.0
-        all_reciprocal_ranks.append(rr)
+    def on_result(i, outcome):
+        completed.append(i)
+        progress(len(completed) / total, desc=f"Evaluated {len(completed)}/{total} questions")
 
-        # Generate answer
-        actual_answer = generate_answer(test["question"], chunks)
+    # One batched retrieval for all questions, then generation and judging per case
+    retrieved = retrieve_many([test["question"] for test in TEST_CASES])
+    outcomes = run_cases(list(zip(TEST_CASES, retrieved)), lambda case: evaluate_case(*case), on_result=on_result)
 
-        # Judge
-        scores = llm_judge(test["question"], test["expected_answer"], actual_answer, chunks)
+    for i, (test, outcome) in enumerate(zip(TEST_CASES, outcomes)):
+        hit, rank, rr = outcome["hit"], outcome["rank"], outcome["rr"]
+        actual_answer, scores = outcome["answer"], outcome["scores"]
+        retrieval_hits += 1 if hit else 0
+        all_reciprocal_ranks.append(rr)
         all_relevance.append(scores["answer_relevance"])
         all_correctness.append(scores["answer_correctness"])
         all_faithfulness.append(scores["faithfulness"])
@@ -400,9 +586,13 @@ with gr.Blocks(title="StayEasy RAG") as demo:
                 inputs=msg,
             )
 
-            # Event handlers — now output sources_display too
-            msg.submit(chat_respond, [msg, chatbot], [msg, chatbot, sources_display])
-            send_btn.click(chat_respond, [msg, chatbot], [msg, chatbot, sources_display])
+            # Event handlers — now output sources_display too. Both share one
+            # concurrency group, so at most CHAT_CONCURRENCY chats run at once.
+            for trigger in (msg.submit, send_btn.click):
+                trigger(
+                    chat_respond_async, [msg, chatbot], [msg, chatbot, sources_display],
+                    concurrency_limit=CHAT_CONCURRENCY, concurrency_id="chat",
+                )
             clear_btn.click(
                 lambda: ([], "", "*Ask a question to see retrieved sources here.*"),
                 None,
@@ -422,7 +612,28 @@ with gr.Blocks(title="StayEasy RAG") as demo:
                 wrap=True,
             )
 
-            eval_btn.click(run_evaluation, outputs=[eval_summary, eval_table])
+            # The evaluation already runs its cases concurrently; one run at a time is enough
+            eval_btn.click(run_evaluation, outputs=[eval_summary, eval_table], concurrency_limit=1)
+
+# Chats waiting for a free slot queue up here (0 = unbounded)
+demo.queue(max_size=CHAT_QUEUE_SIZE or None)
+
+STARTUP_TIMINGS["total (until UI built)"] = time.perf_counter() - _startup_began
+print("Startup breakdown: " + " | ".join(f"{name} {seconds:.2f}s" for name, seconds in STARTUP_TIMINGS.items()))
+
+
+
+def _warm_llm_client():
+    """Create the OpenAI clients (and import openai) off the critical path, before the first question."""
+    try:
+        get_client()
+        get_async_client()
+    except Exception:
+        pass  # e.g. no API key yet; the first real call reports the error
+
+
+threading.Thread(target=_warm_llm_client, daemon=True).start()
 
 if __name__ == "__main__":
+    start_metrics_server()
     demo.launch()
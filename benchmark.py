@@ -0,0 +1,269 @@
+"""
+benchmark.py - Throughput and latency benchmarks for ingest and retrieval
+
+Generates synthetic markdown corpora shaped like data/*.md (H1 title, H2
+sections, H3 subsections, FAQ-style paragraphs full of fees, phone numbers
+and timeframes), then for each size measures:
+  - load_documents / chunk_documents / create_vector_store throughput
+  - retrieve() latency p50 / p95 / p99, and retrieve_many() batch throughput
+  - peak RSS
+
+Each size runs in a fresh process, so peak RSS is per size.
+
+Run:
+    python benchmark.py                         # 10, 100, 1000 and 5500 docs (~100k chunks)
+    python benchmark.py --docs 10,100 --output bench_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import platform
+import subprocess
+import tempfile
+import multiprocessing
+from pathlib import Path
+from queue import Empty
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+DATA_FOLDER = "data"
+DEFAULT_DOC_COUNTS = [10, 100, 1000, 5500]   # ~18 chunks per doc, so up to ~100k chunks
+SECTIONS_PER_DOC = 6
+N_QUERIES = 200
+OUTPUT_PATH = "bench_results.json"
+
+NUMBER_TEMPLATES = [
+    "{pct}%", "${amount}", "{hours} hours", "{days} business days",
+    "1-800-{a}-{b}", "{rating}+ star rating", "{count}+ completed bookings",
+]
+
+
+# ============================================================
+# SYNTHETIC CORPUS
+# ============================================================
+
+def build_vocabulary(folder=DATA_FOLDER):
+    """Words from the real documents, so synthetic text has a realistic term distribution."""
+    words = []
+    for file_path in sorted(Path(folder).glob("*.md")):
+        text = file_path.read_text(encoding="utf-8")
+        words.extend(w.strip("*#-|:()") for w in text.split())
+    return [w for w in words if w.isalpha()] or ["stayeasy", "booking", "host", "guest"]
+
+
+def _fact(rng):
+    template = rng.choice(NUMBER_TEMPLATES)
+    return template.format(
+        pct=rng.randint(1, 20), amount=f"{rng.randint(1, 1000) * 1000:,}",
+        hours=rng.choice([24, 48, 72]), days=rng.randint(1, 10),
+        a=rng.randint(100, 999), b=rng.randint(1000, 9999),
+        rating=round(rng.uniform(4.0, 5.0), 1), count=rng.randint(5, 50),
+    )
+
+
+def _paragraph(rng, vocabulary, n_words):
+    words = [rng.choice(vocabulary) for _ in range(n_words)]
+    words.insert(rng.randrange(len(words)), _fact(rng))
+    return " ".join(words).capitalize() + "."
+
+
+def generate_document(rng, vocabulary, doc_number):
+    """One markdown file: a title and SECTIONS_PER_DOC H2 sections, some long enough to split."""
+    title = " ".join(rng.choice(vocabulary) for _ in range(3)).title()
+    lines = [f"# {title} {doc_number}", "", _paragraph(rng, vocabulary, 25), ""]
+    for section in range(SECTIONS_PER_DOC):
+        lines += [f"## {rng.choice(vocabulary).title()} {section}", ""]
+        if rng.random() < 0.3:
+            # Oversized section: split at H3 and paragraph boundaries
+            for sub in range(3):
+                lines += [f"### {rng.choice(vocabulary).title()} {sub}", ""]
+                for _ in range(3):
+                    lines += [_paragraph(rng, vocabulary, 40), ""]
+        else:
+            for _ in range(rng.randint(1, 3)):
+                lines += [f"- {_paragraph(rng, vocabulary, 15)}"]
+            lines += ["", _paragraph(rng, vocabulary, 30), ""]
+    return "\n".join(lines)
+
+
+def generate_corpus(folder, n_docs, seed=0):
+    """Write n_docs synthetic markdown files into folder."""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary()
+    os.makedirs(folder, exist_ok=True)
+    for i in range(n_docs):
+        Path(folder, f"doc_{i:05d}.md").write_text(generate_document(rng, vocabulary, i), encoding="utf-8")
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_size(n_docs, backend, workers, queue):
+    """Benchmark one corpus size; runs in its own process and puts a result dict on queue."""
+    repo_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="stayeasy-bench-") as work_dir:
+        generate_corpus(os.path.join(work_dir, DATA_FOLDER), n_docs)
+        # ingest.py / answer.py use relative paths (data/, chroma_db/), so run inside the temp dir
+        os.chdir(work_dir)
+        sys.path.insert(0, repo_dir)
+        import ingest
+        import answer
+        from numpy_index import load_backend
+        from embedding_cache import query_cache
+        from sentence_transformers import SentenceTransformer
+
+        documents, load_seconds = _timed(ingest.load_documents, DATA_FOLDER)
+        chunks, chunk_seconds = _timed(ingest.chunk_documents, documents)
+        collection, store_seconds = _timed(ingest.create_vector_store, chunks, rebuild=True, workers=workers)
+        rss_after_ingest = peak_rss_mb()
+
+        embedding_model = SentenceTransformer(ingest.EMBEDDING_MODEL)
+        index = load_backend(collection, backend)
+        rng = random.Random(1)
+        sampled = rng.sample(chunks, min(N_QUERIES, len(chunks)))
+        queries = [f"{chunk['heading'].split(' > ')[-1]} {_fact(rng)}?" for chunk in sampled]
+        answer.retrieve(queries[0], index, embedding_model)  # warm-up
+        query_cache.clear()  # every measured query pays for its embedding
+        latencies = []
+        for question in queries:
+            _, seconds = _timed(answer.retrieve, question, index, embedding_model)
+            latencies.append(seconds * 1000)
+
+        # The same queries as one batch: one encode() call and one multi-vector query
+        query_cache.clear()
+        _, batch_seconds = _timed(answer.retrieve_many, queries, index, embedding_model)
+
+        n_chars = sum(len(doc["content"]) for doc in documents)
+        queue.put({
+            "docs": len(documents),
+            "chunks": len(chunks),
+            "corpus_mb": round(n_chars / 1e6, 2),
+            "backend": backend,
+            "ingest": {
+                "load_documents_docs_per_sec": round(len(documents) / max(load_seconds, 1e-9), 1),
+                "chunk_documents_mb_per_sec": round(n_chars / 1e6 / max(chunk_seconds, 1e-9), 2),
+                "create_vector_store_chunks_per_sec": round(len(chunks) / max(store_seconds, 1e-9), 1),
+                "seconds": {
+                    "load_documents": round(load_seconds, 3),
+                    "chunk_documents": round(chunk_seconds, 3),
+                    "create_vector_store": round(store_seconds, 3),
+                },
+            },
+            "retrieve_ms": {
+                "queries": len(latencies),
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+            },
+            "retrieve_many": {
+                "queries": len(queries),
+                "seconds": round(batch_seconds, 3),
+                "queries_per_sec": round(len(queries) / max(batch_seconds, 1e-9), 1),
+                "sequential_queries_per_sec": round(len(latencies) / max(sum(latencies) / 1000, 1e-9), 1),
+            },
+            "peak_rss_mb": {
+                "after_ingest": round(rss_after_ingest, 1),
+                "after_retrieval": round(peak_rss_mb(), 1),
+            },
+        })
+
+
+def wait_for_result(process, queue):
+    """Read the child's result, then join it; None if it exited without one.
+
+    The queue is read before join(): a child that has put data on a queue
+    does not exit until the data is read, so joining first can deadlock.
+    """
+    result = None
+    while result is None and (process.is_alive() or not queue.empty()):
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            pass
+    process.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StayEasy ingest and retrieval")
+    parser.add_argument("--docs", default=",".join(map(str, DEFAULT_DOC_COUNTS)),
+                        help="comma-separated corpus sizes, in documents")
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "numpy"],
+                        help="retrieval backend to measure")
+    parser.add_argument("--workers", type=int, default=1, help="embedding worker processes for ingest")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="where to write the JSON results")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  StayEasy RAG - Benchmark")
+    print("=" * 60)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for n_docs in [int(n) for n in args.docs.split(",")]:
+        print(f"\n[{n_docs} docs] generating corpus, ingesting, querying...")
+        queue = context.Queue()
+        process = context.Process(target=run_size, args=(n_docs, args.backend, args.workers, queue))
+        process.start()
+        result = wait_for_result(process, queue)
+        if result is None or process.exitcode != 0:
+            raise RuntimeError(f"benchmark for {n_docs} docs failed (exit code {process.exitcode})")
+        results.append(result)
+        print(f"  {result['chunks']} chunks | "
+              f"ingest {result['ingest']['create_vector_store_chunks_per_sec']} chunks/s | "
+              f"retrieve p50 {result['retrieve_ms']['p50']}ms p95 {result['retrieve_ms']['p95']}ms "
+              f"p99 {result['retrieve_ms']['p99']}ms | "
+              f"batched {result['retrieve_many']['queries_per_sec']} q/s | peak RSS {result['peak_rss_mb']['after_retrieval']} MB")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+            "results": results,
+        }, f, indent=2)
+    print(f"\n  Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+bm25_index.py - Keyword (BM25) index and hybrid search
+
+Dense MiniLM similarity is weak on exact tokens such as "1-800-782-9111" or
+"3%". ingest.py builds a small inverted index with BM25 statistics next to the
+Chroma collection, and HybridIndex fuses the keyword ranking with the dense
+ranking using reciprocal rank fusion (RRF).
+
+The index is saved to chroma_db/bm25_index/ as flat .npy arrays (sorted
+terms, per-term offsets into one array of doc numbers and one of term
+frequencies) and opened memory-mapped, like the exported vector index in
+numpy_index.py. API workers (`python api.py --workers 4`) share the
+postings through the OS page cache instead of each building Python lists.
+
+While building, ingest.py holds the postings of at most BM25_SEGMENT_DOCS
+chunks in memory; full segments are written to chroma_db/bm25_segments/ and
+merged into the final arrays at the end.
+
+Settings (environment variables):
+    HYBRID_SEARCH       "1" (default) to fuse BM25 with dense search, "0" for dense only
+    HYBRID_CANDIDATES   results taken from each ranking before fusion (default 20)
+    BM25_SEGMENT_DOCS   chunks whose postings are kept in memory while building (default 50000)
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import shutil
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+import numpy as np
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+BM25_PATH = os.path.join("chroma_db", "bm25_index")
+BM25_SEGMENTS_PATH = os.path.join("chroma_db", "bm25_segments")  # scratch space while ingest.py builds the index
+BM25_SEGMENT_DOCS = int(os.getenv("BM25_SEGMENT_DOCS", "50000"))
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") != "0"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = 60        # standard reciprocal rank fusion constant
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Keeps phone numbers, percentages, prices and hyphenated words as one token
+TOKEN_PATTERN = re.compile(r"\$?[a-z0-9]+(?:[-.,/:][a-z0-9]+)*%?")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "if", "in", "is", "it", "my", "of", "on", "or", "the",
+    "to", "was", "what", "when", "where", "which", "who", "with", "you", "your",
+}
+
+
+# ============================================================
+# TOKENIZER
+# ============================================================
+
+def tokenize(text):
+    """Lowercase word tokens; compound tokens also contribute their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = re.findall(r"[a-z0-9]+", token)
+        if len(parts) > 1 or parts[0] != token:
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+    return tokens
+
+
+# ============================================================
+# BM25 INDEX
+# ============================================================
+
+def _bm25_weights(tfs, doc_lengths, avg_length):
+    """tf part of the BM25 score for arrays of term frequencies and document lengths."""
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / avg_length)
+    return tfs * (BM25_K1 + 1) / (tfs + length_norm)
+
+
+def _idf(n_docs, doc_freq):
+    return math.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def _save_array(path, name, array):
+    """np.save via a temp file and rename, so processes with the old file mapped keep a valid copy."""
+    tmp_path = os.path.join(path, f"{name}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, os.path.join(path, name))
+
+
+def _create_array(path, name, dtype, length):
+    """A writable memory-mapped .npy under a temp name; fill it, then _commit_array() it."""
+    return np.lib.format.open_memmap(os.path.join(path, f"{name}.tmp"), mode="w+", dtype=dtype, shape=(length,))
+
+
+def _commit_array(path, name, array):
+    array.flush()
+    os.replace(os.path.join(path, f"{name}.tmp"), os.path.join(path, name))
+
+
+def _widest(string_arrays):
+    """The string dtype that fits every value of every array (at least one character, like np.asarray([], str))."""
+    return np.result_type(np.dtype("U1"), *[array.dtype for array in string_arrays])
+
+
+def _merged_terms(segments):
+    """Yield (term, [(segment, term position)]) over the sorted term lists of all segments, in term order."""
+    def stream(number, terms):
+        return ((str(term), number, i) for i, term in enumerate(terms))
+
+    streams = [stream(number, segment["terms"]) for number, segment in enumerate(segments)]
+    for term, group in groupby(heapq.merge(*streams), key=itemgetter(0)):
+        yield term, [(number, i) for _, number, i in group]
+
+
+class BM25Index:
+    """Builds the inverted index (term -> [(doc, term frequency)] plus document lengths) during ingest.
+
+    Postings are kept in memory for at most segment_docs chunks at a time;
+    full segments are written to work_dir and merged into the final arrays
+    by save(), so building the index does not need memory in proportion to
+    the corpus.
+    """
+
+    def __init__(self, index_version="", segment_docs=BM25_SEGMENT_DOCS, work_dir=BM25_SEGMENTS_PATH):
+        self.index_version = index_version
+        self.segment_docs = max(1, segment_docs)
+        self.work_dir = work_dir
+        self.n_docs = 0
+        self._segments = []    # the flushed segments, memory-mapped
+        self._ids = []         # the current segment's chunks
+        self._id_set = set()
+        self._doc_lengths = []
+        self._postings = defaultdict(list)
+
+    def add(self, chunk_id, text):
+        tokens = tokenize(text)
+        doc = self.n_docs
+        self.n_docs += 1
+        self._ids.append(chunk_id)
+        self._id_set.add(chunk_id)
+        self._doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self._postings[term].append((doc, tf))
+        if len(self._ids) >= self.segment_docs:
+            self._flush_segment()
+
+    def __contains__(self, chunk_id):
+        """Whether chunk_id has been added; ingest.py uses this to find orphaned IDs."""
+        if chunk_id in self._id_set:
+            return True
+        for segment in self._segments:
+            sorted_ids = segment["sorted_ids"]
+            i = int(np.searchsorted(sorted_ids, chunk_id))
+            if i < len(sorted_ids) and sorted_ids[i] == chunk_id:
+                return True
+        return False
+
+    def _flush_segment(self):
+        if not self._ids:
+            return
+        if not self._segments and os.path.exists(self.work_dir):
+            shutil.rmtree(self.work_dir)  # left over from an interrupted ingest
+        path = os.path.join(self.work_dir, f"segment_{len(self._segments)}")
+        os.makedirs(path)
+        terms = sorted(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self._postings[term]) for term in terms])
+        pairs = np.array([pair for term in terms for pair in self._postings[term]], dtype=np.int32).reshape(-1, 2)
+        ids = np.asarray(self._ids, dtype=str)
+        np.save(os.path.join(path, "terms.npy"), np.asarray(terms, dtype=str))
+        np.save(os.path.join(path, "term_offsets.npy"), offsets)
+        np.save(os.path.join(path, "posting_docs.npy"), np.ascontiguousarray(pairs[:, 0]))
+        np.save(os.path.join(path, "posting_tfs.npy"), np.ascontiguousarray(pairs[:, 1]))
+        np.save(os.path.join(path, "ids.npy"), ids)
+        np.save(os.path.join(path, "sorted_ids.npy"), np.sort(ids))
+        np.save(os.path.join(path, "doc_lengths.npy"), np.asarray(self._doc_lengths, dtype=np.int32))
+        self._segments.append({
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("terms", "term_offsets", "posting_docs", "posting_tfs", "ids", "sorted_ids", "doc_lengths")
+        })
+        self._ids, self._id_set, self._doc_lengths = [], set(), []
+        self._postings = defaultdict(list)
+
+    def save(self, path=BM25_PATH):
+        """Merge the segments into the flat arrays MappedBM25Index opens and return the number of terms.
+
+        index.json goes last and marks the save complete.
+        """
+        os.makedirs(path, exist_ok=True)
+        self._flush_segment()
+        segments = self._segments
+        try:
+            ids = _create_array(path, "ids.npy", _widest(segment["ids"] for segment in segments), self.n_docs)
+            doc_lengths = _create_array(path, "doc_lengths.npy", np.int32, self.n_docs)
+            start = 0
+            for segment in segments:
+                ids[start:start + len(segment["ids"])] = segment["ids"]
+                doc_lengths[start:start + len(segment["ids"])] = segment["doc_lengths"]
+                start += len(segment["ids"])
+
+            # Two passes over the merged vocabulary: count the terms, then copy their postings
+            n_terms = sum(1 for _ in _merged_terms(segments))
+            n_postings = sum(len(segment["posting_docs"]) for segment in segments)
+            terms = _create_array(path, "terms.npy", _widest(segment["terms"] for segment in segments), n_terms)
+            offsets = _create_array(path, "term_offsets.npy", np.int64, n_terms + 1)
+            docs = _create_array(path, "posting_docs.npy", np.int32, n_postings)
+            tfs = _create_array(path, "posting_tfs.npy", np.int32, n_postings)
+            offsets[0] = end = 0
+            for k, (term, parts) in enumerate(_merged_terms(segments)):
+                terms[k] = term
+                # Segments hold consecutive doc numbers, so each term's docs stay in ascending order
+                for number, i in parts:
+                    segment = segments[number]
+                    first, last = int(segment["term_offsets"][i]), int(segment["term_offsets"][i + 1])
+                    docs[end:end + last - first] = segment["posting_docs"][first:last]
+                    tfs[end:end + last - first] = segment["posting_tfs"][first:last]
+                    end += last - first
+                offsets[k + 1] = end
+
+            for name, array in (("terms.npy", terms), ("term_offsets.npy", offsets), ("posting_docs.npy", docs),
+                                ("posting_tfs.npy", tfs), ("ids.npy", ids), ("doc_lengths.npy", doc_lengths)):
+                _commit_array(path, name, array)
+        finally:
+            self._segments = []
+            if os.path.exists(self.work_dir):
+                shutil.rmtree(self.work_dir)
+        tmp_path = os.path.join(path, "index.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"index_version": self.index_version}, f)
+        os.replace(tmp_path, os.path.join(path, "index.json"))
+        return n_terms
+
+
+class MappedBM25Index:
+    """A saved BM25Index, searched straight from memory-mapped arrays."""
+
+    def __init__(self, path=BM25_PATH):
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            self.index_version = json.load(f).get("index_version", "")
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.terms = load("terms.npy")
+        self.term_offsets = load("term_offsets.npy")
+        self.posting_docs = load("posting_docs.npy")
+        self.posting_tfs = load("posting_tfs.npy")
+        self.ids = load("ids.npy")
+        self.doc_lengths = load("doc_lengths.npy")
+        self.avg_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 1.0
+        self.avg_length = self.avg_length or 1.0
+
+    def _postings(self, term):
+        """(docs, tfs) slices for a term, or None; terms are found by binary search."""
+        i = int(np.searchsorted(self.terms, term))
+        if i >= len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = int(self.term_offsets[i]), int(self.term_offsets[i + 1])
+        return self.posting_docs[start:end], self.posting_tfs[start:end]
+
+    def search(self, query, top_k):
+        """Return [(chunk_id, score)] for the top_k BM25 matches, best first."""
+        n_docs = len(self.ids)
+        if not n_docs:
+            return []
+        scores = np.zeros(n_docs)
+        for term in set(tokenize(query)):
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            # A term lists each doc once, so the fancy-indexed += does not drop repeats
+            scores[docs] += _idf(n_docs, len(docs)) * _bm25_weights(
+                tfs.astype(np.float64), self.doc_lengths[docs], self.avg_length
+            )
+        matched = np.flatnonzero(scores)
+        best = matched[np.argsort(-scores[matched], kind="stable")[:top_k]]
+        return [(str(self.ids[doc]), float(scores[doc])) for doc in best]
+
+
+def load_bm25_index(index_version, path=BM25_PATH):
+    """Load the BM25 index if it exists and matches the collection, else None."""
+    if not os.path.exists(os.path.join(path, "index.json")):
+        print("No BM25 index found (run ingest.py), using dense search only")
+        return None
+    index = MappedBM25Index(path)
+    if index.index_version != index_version:
+        print("BM25 index is out of date (run ingest.py), using dense search only")
+        return None
+    return index
+
+
+# ============================================================
+# HYBRID SEARCH
+# ============================================================
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge several ranked ID lists into one: score = sum of 1 / (k + rank)."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda chunk_id: -scores[chunk_id])
+
+
+def index_space(metadata):
+    """Distance space of a collection; ingest.py keeps a copy in "space" because Chroma drops hnsw:space on modify()."""
+    metadata = metadata or {}
+    return metadata.get("hnsw:space", metadata.get("space", "l2"))
+
+
+def _distance(space, query, embedding):
+    """Distance between two vectors the way Chroma reports it for this space."""
+    query = np.asarray(query, dtype=np.float32)
+    embedding = np.asarray(embedding, dtype=np.float32)
+    if space == "l2":
+        return float(np.sum((query - embedding) ** 2))
+    if space == "cosine":
+        return float(1.0 - query @ embedding / (np.linalg.norm(query) * np.linalg.norm(embedding)))
+    return float(1.0 - query @ embedding)
+
+
+class HybridIndex:
+    """Wraps a dense backend (Chroma collection or NumpyIndex) and adds BM25 fusion.
+
+    query() takes an extra query_texts argument; without it (or without a BM25
+    index) it is a plain dense query. Everything else is passed through.
+    """
+
+    def __init__(self, dense, bm25=None, candidates=HYBRID_CANDIDATES):
+        self.dense = dense
+        self.bm25 = bm25
+        self.candidates = candidates
+
+    def __getattr__(self, name):
+        return getattr(self.dense, name)
+
+    def query(self, query_embeddings, n_results=10, query_texts=None, **kwargs):
+        if self.bm25 is None or query_texts is None:
+            return self.dense.query(query_embeddings=query_embeddings, n_results=n_results, **kwargs)
+
+        n_candidates = max(n_results, self.candidates)
+        dense = self.dense.query(query_embeddings=query_embeddings, n_results=n_candidates)
+        all_records, all_fused = [], []
+        for q, text in enumerate(query_texts):
+            all_records.append({
+                chunk_id: (document, metadata, distance)
+                for chunk_id, document, metadata, distance in zip(
+                    dense["ids"][q], dense["documents"][q], dense["metadatas"][q], dense["distances"][q]
+                )
+            })
+            lexical = [chunk_id for chunk_id, _ in self.bm25.search(text, n_candidates)]
+            all_fused.append(reciprocal_rank_fusion([dense["ids"][q], lexical])[:n_results])
+
+        # Keyword-only hits were not in the dense results; fetch them (one request
+        # for the whole batch) and compute their real vector distance so callers
+        # see consistent numbers.
+        missing = sorted({
+            chunk_id
+            for records, fused in zip(all_records, all_fused)
+            for chunk_id in fused if chunk_id not in records
+        })
+        extra = {}
+        if missing:
+            fetched = self.dense.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            extra = {
+                chunk_id: (document, metadata, vector)
+                for chunk_id, document, metadata, vector in zip(
+                    fetched["ids"], fetched["documents"], fetched["metadatas"], fetched["embeddings"]
+                )
+            }
+        space = index_space(self.dense.metadata)
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for records, fused, embedding in zip(all_records, all_fused, query_embeddings):
+            for chunk_id in fused:
+                if chunk_id not in records and chunk_id in extra:
+                    document, metadata, vector = extra[chunk_id]
+                    records[chunk_id] = (document, metadata, _distance(space, embedding, vector))
+            fused = [chunk_id for chunk_id in fused if chunk_id in records]
+
+            results["ids"].append(fused)
+            results["documents"].append([records[chunk_id][0] for chunk_id in fused])
+            results["metadatas"].append([records[chunk_id][1] for chunk_id in fused])
+            results["distances"].append([records[chunk_id][2] for chunk_id in fused])
+        return results
@@ -0,0 +1,16 @@
+"""
+config.py - Settings that every script must agree on
+
+The embedding model is used to embed the documents (ingest.py), every
+question (answer.py, app.py, api.py, evaluate.py), and in the keys and
+fingerprints that decide whether stored vectors are still valid (the query
+cache, the ONNX export and its parity check, chunk fingerprints). A
+mismatch anywhere silently mixes vectors from two models, so the name is
+defined once here and imported everywhere else.
+"""
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
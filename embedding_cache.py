@@ -0,0 +1,148 @@
+"""
+embedding_cache.py - Bounded LRU cache for query embeddings
+
+Support traffic repeats the same questions over and over, so retrieve() looks
+the question up here before running the embedding model.
+
+Settings (environment variables):
+    QUERY_CACHE_SIZE   max number of cached questions (default 1024, 0 disables)
+    QUERY_CACHE_TTL    seconds before an entry expires (default 3600, 0 = never)
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from config import EMBEDDING_MODEL
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+
+# ============================================================
+# CACHE
+# ============================================================
+
+# Hugging Face fast tokenizers are not safe to call from several threads at
+# once ("Already borrowed"), so model calls from concurrent requests take turns.
+model_lock = threading.Lock()
+
+
+def _encode(embedding_model, sentences):
+    """embedding_model.encode() under model_lock, unless the encoder serializes model access itself."""
+    if getattr(embedding_model, "locks_model", False):
+        return embedding_model.encode(sentences)
+    with model_lock:
+        return embedding_model.encode(sentences)
+
+
+def encoder_variant(embedding_model):
+    """Which implementation produces the embeddings ("torch", "onnx", "onnx-int8").
+
+    Part of the cache key: the ONNX int8 encoder gives numerically different
+    vectors for the same model name.
+    """
+    return getattr(embedding_model, "variant", "torch")
+
+
+def normalize_question(question):
+    """Collapse case and whitespace; all-MiniLM-L6-v2 is uncased, so the embedding is unchanged."""
+    return " ".join(question.lower().split())
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of query embeddings keyed on (model name, encoder variant, normalized question)."""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, embedding = entry
+                if not self.ttl or time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, embedding):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def encode(self, embedding_model, question, model_name=EMBEDDING_MODEL):
+        """Return the embedding for question, running the model only on a cache miss."""
+        key = (model_name, encoder_variant(embedding_model), normalize_question(question))
+        embedding = self.get(key)
+        if embedding is None:
+            embedding = _encode(embedding_model, question)
+            # Shared between callers, so make sure nobody mutates it in place
+            embedding.setflags(write=False)
+            self.put(key, embedding)
+        return embedding
+
+    def encode_many(self, embedding_model, questions, model_name=EMBEDDING_MODEL):
+        """Embeddings for several questions, in order; all cache misses share one model.encode() call."""
+        variant = encoder_variant(embedding_model)
+        keys = [(model_name, variant, normalize_question(question)) for question in questions]
+        embeddings = [self.get(key) for key in keys]
+        missing = {}  # key -> question, so repeated questions are only encoded once
+        for key, question, embedding in zip(keys, questions, embeddings):
+            if embedding is None:
+                missing.setdefault(key, question)
+        if missing:
+            encoded = _encode(embedding_model, list(missing.values()))
+            fresh = {}
+            for key, embedding in zip(missing, encoded):
+                embedding.setflags(write=False)
+                self.put(key, embedding)
+                fresh[key] = embedding
+            embeddings = [fresh[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+        return embeddings
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# One process-wide cache shared by answer.py, app.py and evaluate.py
+query_cache = EmbeddingCache()
+
+
+def encode_query(embedding_model, question, model_name=EMBEDDING_MODEL):
+    """Embed a question through the shared query cache."""
+    return query_cache.encode(embedding_model, question, model_name)
+
+
+def encode_queries(embedding_model, questions, model_name=EMBEDDING_MODEL):
+    """Embed a batch of questions through the shared query cache."""
+    return query_cache.encode_many(embedding_model, questions, model_name)
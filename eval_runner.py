@@ -0,0 +1,40 @@
+"""
+eval_runner.py - Run evaluation test cases concurrently
+
+Each test case spends almost all of its time waiting on OpenAI (generate the
+answer, then judge it), so cases are spread over a thread pool. While one case
+waits on the judge, others are retrieving or generating. Results always come
+back in the same order as the test cases.
+
+Settings (environment variables):
+    EVAL_CONCURRENCY   max test cases in flight at once (default 8)
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "8"))
+
+
+def run_cases(cases, evaluate_case, concurrency=EVAL_CONCURRENCY, on_result=None):
+    """Run evaluate_case(case) for every case with at most `concurrency` in flight.
+
+    on_result(index, result) is called as each case finishes (in completion
+    order, on the calling thread). The returned list is in input order.
+    If a case raises, the cases that have not started are cancelled (so their
+    OpenAI calls are never made) and the error is raised right away.
+    """
+    results = [None] * len(cases)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(evaluate_case, case): i for i, case in enumerate(cases)}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if on_result is not None:
+                    on_result(i, results[i])
+        except BaseException:
+            # Leaving the with block would otherwise wait for every queued case
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    return results
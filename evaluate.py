@@ -8,14 +8,24 @@ Metrics:
 
 Run:
     python evaluate.py
+    python evaluate.py --concurrency 16   # test cases evaluated in parallel
+    python evaluate.py --backend compact  # also checks recall@5 against exact search
+    python evaluate.py --no-cache         # call the LLM for every case (see llm_cache.py)
 """
 
 import os
 import json
+import argparse
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
+from onnx_encoder import load_query_encoder
 import chromadb
-from openai import OpenAI
+from llm_client import get_client
+from llm_cache import llm_cache
+from eval_runner import run_cases, EVAL_CONCURRENCY
+from numpy_index import load_backend, RETRIEVAL_BACKEND
+from answer import retrieve_many
+from config import EMBEDDING_MODEL
 
 load_dotenv()
 
@@ -27,6 +37,9 @@ CHROMA_PATH = "chroma_db"
 COLLECTION_NAME = "stayeasy_docs"
 TOP_K = 5
 
+# How far recall@5 on the compact (quantized) index may fall below exact search
+RECALL_TOLERANCE = float(os.getenv("RECALL_TOLERANCE", "0.05"))
+
 # ============================================================
 # TEST DATASET - Questions with expected answers & source files
 # ============================================================
@@ -85,26 +98,6 @@ TEST_CASES = [
 ]
 
 
-# ============================================================
-# RETRIEVAL (same as answer.py)
-# ============================================================
-
-def retrieve(question, collection, embedding_model, top_k=TOP_K):
-    question_embedding = embedding_model.encode(question).tolist()
-    results = collection.query(
-        query_embeddings=[question_embedding],
-        n_results=top_k,
-    )
-    chunks = []
-    for i in range(len(results["documents"][0])):
-        chunks.append({
-            "text": results["documents"][0][i],
-            "filename": results["metadatas"][0][i]["filename"],
-            "distance": results["distances"][0][i],
-        })
-    return chunks
-
-
 # ============================================================
 # LLM-BASED EVALUATION (using GPT-4o-mini as judge)
 # ============================================================
@@ -134,8 +127,8 @@ Score these three metrics (1=worst, 5=best):
 Respond in this exact JSON format only, no other text:
 {{"answer_relevance": <1-5>, "answer_correctness": <1-5>, "faithfulness": <1-5>}}"""
 
-    client = OpenAI()
-    response = client.chat.completions.create(
+    content = llm_cache.complete(
+        get_client(),
         model="gpt-4o-mini",
         messages=[{"role": "user", "content": prompt}],
         temperature=0,
@@ -143,8 +136,8 @@ Respond in this exact JSON format only, no other text:
     )
 
     try:
-        scores = json.loads(response.choices[0].message.content)
-    except json.JSONDecodeError:
+        scores = json.loads(content)
+    except (json.JSONDecodeError, TypeError):
         scores = {"answer_relevance": 0, "answer_correctness": 0, "faithfulness": 0}
 
     return scores
@@ -172,8 +165,8 @@ QUESTION: {question}
 
 ANSWER:"""
 
-    client = OpenAI()
-    response = client.chat.completions.create(
+    return llm_cache.complete(
+        get_client(),
         model="gpt-4o-mini",
         messages=[
             {"role": "system", "content": "You are a helpful StayEasy customer support assistant. Answer questions directly and precisely, prioritizing the most specific facts from the provided context."},
@@ -182,29 +175,137 @@ ANSWER:"""
         temperature=0,
         max_tokens=500,
     )
-    return response.choices[0].message.content
 
 
 # ============================================================
 # MAIN EVALUATION
 # ============================================================
 
+def evaluate_case(test, chunks):
+    """Generate and judge a single test case from its retrieved chunks."""
+
+    # Step 1: Retrieved chunks (fetched for all cases at once by answer.retrieve_many)
+    source_files = [c["filename"] for c in chunks]
+
+    # Check if expected source was retrieved + compute reciprocal rank
+    hit = test["expected_source"] in source_files
+    if hit:
+        rank = source_files.index(test["expected_source"]) + 1  # 1-indexed
+        reciprocal_rank = 1.0 / rank
+    else:
+        rank = 0
+        reciprocal_rank = 0.0
+
+    # Step 2: Generate answer
+    actual_answer = generate_answer(test["question"], chunks)
+
+    # Step 3: LLM Judge
+    scores = llm_judge(
+        test["question"],
+        test["expected_answer"],
+        actual_answer,
+        chunks,
+    )
+
+    return {
+        "question": test["question"],
+        "expected_source": test["expected_source"],
+        "retrieved_sources": source_files,
+        "retrieval_hit": hit,
+        "rank": rank,
+        "reciprocal_rank": reciprocal_rank,
+        "expected_answer": test["expected_answer"],
+        "actual_answer": actual_answer,
+        "scores": scores,
+    }
+
+
+def print_case(i, total, result):
+    print(f"\n{'─' * 60}")
+    print(f"  [{i+1}/{total}] {result['question']}")
+    print(f"{'─' * 60}")
+    print(f"  Retrieved: {result['retrieved_sources']}")
+    print(f"  Expected source: {result['expected_source']} → {'HIT' if result['retrieval_hit'] else 'MISS'} "
+          f"(rank: {result['rank']}, RR: {result['reciprocal_rank']:.2f})")
+    print(f"  Expected: {result['expected_answer']}")
+    print(f"  Actual:   {result['actual_answer']}")
+    scores = result["scores"]
+    print(f"  Scores → Relevance: {scores['answer_relevance']}/5  "
+          f"Correctness: {scores['answer_correctness']}/5  "
+          f"Faithfulness: {scores['faithfulness']}/5")
+
+
+def recall_at_5(collection, embedding_model):
+    """Fraction of TEST_CASES whose expected source is in the top 5 (retrieval only)."""
+    retrieved = retrieve_many([test["question"] for test in TEST_CASES],
+                              collection=collection, embedding_model=embedding_model, top_k=5)
+    hits = 0
+    for test, chunks in zip(TEST_CASES, retrieved):
+        hits += 1 if test["expected_source"] in [c["filename"] for c in chunks] else 0
+    return hits / len(TEST_CASES)
+
+
+def check_compact_recall(collection, raw_collection, embedding_model, tolerance):
+    """Compare recall@5 of the compact index with exact search over the same collection."""
+    exact = load_backend(raw_collection, "numpy")
+    compact_recall = recall_at_5(collection, embedding_model)
+    exact_recall = recall_at_5(exact, embedding_model)
+    passed = compact_recall >= exact_recall - tolerance
+    print(f"Compact index recall@5: {compact_recall:.1%} vs exact {exact_recall:.1%} "
+          f"(tolerance {tolerance:.1%}) → {'OK' if passed else 'FAIL'}\n")
+    return {
+        "compact_recall_at_5": round(compact_recall, 4),
+        "exact_recall_at_5": round(exact_recall, 4),
+        "tolerance": tolerance,
+        "passed": passed,
+    }
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Evaluate the StayEasy RAG system")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY,
+                        help="max test cases evaluated at once")
+    parser.add_argument("--backend", choices=["chroma", "numpy", "compact"], default=RETRIEVAL_BACKEND,
+                        help="vector search backend used for retrieval")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore cached LLM answers and judge scores (llm_cache/)")
+    parser.add_argument("--recall-tolerance", type=float, default=RECALL_TOLERANCE,
+                        help="allowed recall@5 drop of the compact index versus exact search")
+    args = parser.parse_args()
+    if args.no_cache:
+        llm_cache.enabled = False
+
     print("=" * 60)
     print("  StayEasy RAG - Evaluation")
     print("=" * 60)
 
     # Load models & data
     print("\nLoading embedding model...")
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+    embedding_model = load_query_encoder(SentenceTransformer(EMBEDDING_MODEL))
 
     print("Loading vector database...")
     client = chromadb.PersistentClient(path=CHROMA_PATH)
-    collection = client.get_collection(name=COLLECTION_NAME)
+    raw_collection = client.get_collection(name=COLLECTION_NAME)
+    collection = load_backend(raw_collection, args.backend)
     print(f"Loaded {collection.count()} chunks\n")
 
-    # Metrics accumulators
+    compact_check = None
+    if args.backend == "compact":
+        compact_check = check_compact_recall(collection, raw_collection, embedding_model, args.recall_tolerance)
+
+    # Retrieve for every question in one batch, then generate and judge up to
+    # --concurrency cases at a time (results stay in TEST_CASES order)
     total = len(TEST_CASES)
+    retrieved = retrieve_many([test["question"] for test in TEST_CASES],
+                              collection=collection, embedding_model=embedding_model, top_k=TOP_K)
+    results = run_cases(
+        list(zip(TEST_CASES, retrieved)),
+        lambda case: evaluate_case(*case),
+        concurrency=args.concurrency,
+        on_result=lambda i, result: print_case(i, total, result),
+    )
+
+    # Metrics accumulators
     retrieval_hits = 0
     recall_at_1 = 0
     recall_at_3 = 0
@@ -214,71 +315,23 @@ def main():
     all_correctness = []
     all_faithfulness = []
 
-    results = []
-
-    for i, test in enumerate(TEST_CASES):
-        print(f"\n{'─' * 60}")
-        print(f"  [{i+1}/{total}] {test['question']}")
-        print(f"{'─' * 60}")
-
-        # Step 1: Retrieve
-        chunks = retrieve(test["question"], collection, embedding_model)
-        source_files = [c["filename"] for c in chunks]
-
-        # Check if expected source was retrieved + compute reciprocal rank
-        hit = test["expected_source"] in source_files
-        retrieval_hits += 1 if hit else 0
+    for result in results:
+        source_files = result["retrieved_sources"]
+        expected_source = result["expected_source"]
+        retrieval_hits += 1 if result["retrieval_hit"] else 0
 
         # Calculate recall@k for k=1, 3, 5
-        if len(source_files) > 0 and test["expected_source"] in source_files[:1]:
+        if len(source_files) > 0 and expected_source in source_files[:1]:
             recall_at_1 += 1
-        if len(source_files) > 0 and test["expected_source"] in source_files[:3]:
+        if len(source_files) > 0 and expected_source in source_files[:3]:
             recall_at_3 += 1
-        if len(source_files) > 0 and test["expected_source"] in source_files[:5]:
+        if len(source_files) > 0 and expected_source in source_files[:5]:
             recall_at_5 += 1
 
-        if hit:
-            rank = source_files.index(test["expected_source"]) + 1  # 1-indexed
-            reciprocal_rank = 1.0 / rank
-        else:
-            rank = 0
-            reciprocal_rank = 0.0
-        all_reciprocal_ranks.append(reciprocal_rank)
-
-        print(f"  Retrieved: {source_files}")
-        print(f"  Expected source: {test['expected_source']} → {'HIT' if hit else 'MISS'} (rank: {rank}, RR: {reciprocal_rank:.2f})")
-
-        # Step 2: Generate answer
-        actual_answer = generate_answer(test["question"], chunks)
-        print(f"  Expected: {test['expected_answer']}")
-        print(f"  Actual:   {actual_answer}")
-
-        # Step 3: LLM Judge
-        scores = llm_judge(
-            test["question"],
-            test["expected_answer"],
-            actual_answer,
-            chunks,
-        )
-        all_relevance.append(scores["answer_relevance"])
-        all_correctness.append(scores["answer_correctness"])
-        all_faithfulness.append(scores["faithfulness"])
-
-        print(f"  Scores → Relevance: {scores['answer_relevance']}/5  "
-              f"Correctness: {scores['answer_correctness']}/5  "
-              f"Faithfulness: {scores['faithfulness']}/5")
-
-        results.append({
-            "question": test["question"],
-            "expected_source": test["expected_source"],
-            "retrieved_sources": source_files,
-            "retrieval_hit": hit,
-            "rank": rank,
-            "reciprocal_rank": reciprocal_rank,
-            "expected_answer": test["expected_answer"],
-            "actual_answer": actual_answer,
-            "scores": scores,
-        })
+        all_reciprocal_ranks.append(result["reciprocal_rank"])
+        all_relevance.append(result["scores"]["answer_relevance"])
+        all_correctness.append(result["scores"]["answer_correctness"])
+        all_faithfulness.append(result["scores"]["faithfulness"])
 
     # ============================================================
     # SUMMARY
@@ -309,6 +362,14 @@ def main():
     print(f"  Avg Answer Relevance:  {avg_relevance:.2f}/5")
     print(f"  Avg Answer Correctness:{avg_correctness:.2f}/5")
     print(f"  Avg Faithfulness:      {avg_faithfulness:.2f}/5")
+    cache_stats = llm_cache.stats()
+    print(f"\n  LLM CACHE:")
+    print(f"  ──────────────────────")
+    if llm_cache.enabled:
+        print(f"  Reused from cache:     {cache_stats['hits']} calls")
+    else:
+        print(f"  Cache disabled (--no-cache)")
+    print(f"  Recomputed:            {cache_stats['misses']} calls")
     print(f"{'=' * 60}")
 
     # Overall score (now includes MRR)
@@ -339,12 +400,17 @@ def main():
                     "avg_faithfulness": round(avg_faithfulness, 2),
                 },
                 "overall_score": round(overall, 1),
+                "llm_cache": {**cache_stats, "enabled": llm_cache.enabled},
+                **({"compact_index_check": compact_check} if compact_check else {}),
             },
             "details": results,
         }, f, indent=2)
 
     print(f"\n  Detailed results saved to: evaluation_results.json")
 
+    if compact_check and not compact_check["passed"]:
+        raise SystemExit("Compact index recall@5 is outside tolerance; re-export with a larger --pca or float16")
+
 
 if __name__ == "__main__":
     main()
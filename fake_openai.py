@@ -0,0 +1,208 @@
+"""
+fake_openai.py - Local stand-in for the OpenAI chat completions API
+
+Answers POST /v1/chat/completions with made-up text, both as one JSON
+response and as a server-sent event stream (stream=true), with a tunable
+delay before the first token, a tunable token rate and an optional share of
+failed requests. Load tests and offline runs can then exercise the whole
+chat path without an API key or network access.
+
+Judge prompts (the ones asking for "answer_relevance") get a valid JSON
+score back, so evaluate.py also runs against it.
+
+Run:
+    python fake_openai.py --port 8100
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake python app.py
+
+Settings (environment variables, or the matching command-line flags):
+    FAKE_LLM_LATENCY_MS     delay before the first token (default 300)
+    FAKE_LLM_TOKENS_PER_SEC streaming rate (default 50, 0 = no delay between tokens)
+    FAKE_LLM_TOKENS         tokens per answer (default 60)
+    FAKE_LLM_ERROR_RATE     fraction of requests answered with HTTP 500 (default 0)
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+PORT = 8100
+LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "50"))
+COMPLETION_TOKENS = int(os.getenv("FAKE_LLM_TOKENS", "60"))
+ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+
+FILLER = (
+    "Based on the StayEasy documentation, here is what applies to your question. "
+    "Please check the listing details and your booking confirmation for specifics, "
+    "and contact support if anything looks different from what you expected."
+).split()
+JUDGE_REPLY = '{"answer_relevance": 5, "answer_correctness": 4, "faithfulness": 5}'
+
+
+# ============================================================
+# RESPONSES
+# ============================================================
+
+def reply_tokens(messages, n_tokens):
+    """The answer as a list of text deltas."""
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "answer_relevance" in prompt:
+        return [JUDGE_REPLY]
+    return [(" " if i else "") + FILLER[i % len(FILLER)] for i in range(n_tokens)]
+
+
+def _usage(messages, completion_tokens):
+    # Roughly 4 characters per token, which is close enough for load testing
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the client's connection pool behaves as it would against the real API
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        settings = self.server.settings
+        request = json.loads(body or b"{}")
+        messages = request.get("messages", [])
+
+        time.sleep(settings["latency_ms"] / 1000)
+        if random.random() < settings["error_rate"]:
+            self._send_json(500, {"error": {"message": "Simulated server error", "type": "server_error"}})
+            return
+
+        tokens = reply_tokens(messages, min(settings["tokens"], request.get("max_tokens") or settings["tokens"]))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get("model", "gpt-4o-mini")
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            self._stream(completion_id, model, tokens, _usage(messages, len(tokens)) if include_usage else None)
+        else:
+            time.sleep(len(tokens) / settings["tokens_per_sec"] if settings["tokens_per_sec"] else 0)
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": _usage(messages, len(tokens)),
+            })
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, completion_id, model, tokens, usage):
+        """Send the answer as server-sent events over chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        delay = 1 / self.server.settings["tokens_per_sec"] if self.server.settings["tokens_per_sec"] else 0
+
+        def event(choices, extra=None):
+            payload = {
+                "id": completion_id, "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model, "choices": choices, **(extra or {}),
+            }
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n")
+
+        event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for token in tokens:
+            if delay:
+                time.sleep(delay)
+            event([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if usage is not None:
+            event([], {"usage": usage})
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown out the load test report
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections under load (clients then wait ~1 s to retry)
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # Clients drop idle keep-alive connections whenever they like; that is not an error
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_fake_server(port=0, latency_ms=LATENCY_MS, tokens_per_sec=TOKENS_PER_SEC,
+                      tokens=COMPLETION_TOKENS, error_rate=ERROR_RATE):
+    """Serve the fake API from a background thread; port=0 picks a free port.
+
+    The returned server has a .base_url to pass to llm_client.configure().
+    """
+    server = FakeOpenAIServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.settings = {
+        "latency_ms": latency_ms,
+        "tokens_per_sec": tokens_per_sec,
+        "tokens": tokens,
+        "error_rate": error_rate,
+    }
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS, help="delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=TOKENS_PER_SEC, help="streaming rate")
+    parser.add_argument("--tokens", type=int, default=COMPLETION_TOKENS, help="tokens per answer")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="fraction of requests that fail")
+    args = parser.parse_args()
+
+    server = start_fake_server(args.port, args.latency_ms, args.tokens_per_sec, args.tokens, args.error_rate)
+    print(f"Fake OpenAI API listening on {server.base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,50 @@
 """
 ingest.py - Load documents, chunk them, embed them, store in ChromaDB
 
+Also writes a BM25 keyword index (chroma_db/bm25_index/) used for hybrid search.
+
 Run this once (or when documents change):
     python ingest.py
+
+Re-running only embeds chunks whose content changed since the last ingest.
+To wipe the collection and embed everything from scratch:
+    python ingest.py --rebuild
+
+Each chunk's file, byte offsets and line range are stored as metadata. To
+keep the chunk text out of ChromaDB and read it from data/ when retrieved:
+    python ingest.py --no-documents
+
+On multi-core machines, spread embedding across worker processes:
+    python ingest.py --workers 8 --batch-size 128
+
+To also export a compact (int8 or float16, optionally PCA-reduced) index for
+RETRIEVAL_BACKEND=compact:
+    python ingest.py --export-index int8 --pca 128
+
+To choose the HNSW parameters of the Chroma index (see INDEX_PROFILES, and
+sweep_index.py for measuring recall and latency of each):
+    python ingest.py --index-profile balanced
+    python ingest.py --index-profile "M=32,construction_ef=200,search_ef=100"
+Changing the profile rebuilds the index from the stored embeddings; nothing
+is re-embedded.
+
+Documents are streamed and written in batches, so an interrupted run can be
+resumed by running it again (without --rebuild).
 """
 
 import os
+import argparse
+import hashlib
+import time
+from bisect import bisect_right
 from pathlib import Path
+import numpy as np
 from sentence_transformers import SentenceTransformer
 import chromadb
+from bm25_index import BM25Index, BM25_PATH
+from numpy_index import export_index
+from source_text import fingerprint, STORE_DOCUMENTS
+from config import EMBEDDING_MODEL
 
 # ============================================================
 # STEP 1: CONFIGURATION
@@ -21,195 +57,574 @@ COLLECTION_NAME = "stayeasy_docs"
 # Chunking settings
 CHUNK_SIZE = 800       # max characters per chunk (only splits large sections)
 
+# Embedding settings
+EMBED_BATCH_SIZE = 64  # sentences per forward pass
+EMBED_WORKERS = 1      # CPU processes used for embedding (1 = encode in-process)
+INGEST_BATCH_SIZE = 512  # chunks embedded and written to ChromaDB per batch, per embedding worker
+
+# HNSW index profiles. Chroma's defaults are l2, M=16, construction_ef=100,
+# search_ef=10. MiniLM embeddings are normalized, so l2 and cosine rank the same.
+HNSW_DEFAULTS = {"space": "l2", "M": 16, "construction_ef": 100, "search_ef": 10}
+INDEX_PROFILES = {
+    "default": {},
+    "fast": {"M": 8, "construction_ef": 64, "search_ef": 10},
+    "balanced": {"M": 16, "construction_ef": 200, "search_ef": 64},
+    "accurate": {"M": 32, "construction_ef": 400, "search_ef": 200},
+}
+INDEX_PROFILE = os.getenv("INDEX_PROFILE")  # None = keep the existing collection's profile
+
 
 # ============================================================
 # STEP 2: LOAD DOCUMENTS
 # ============================================================
 
-def load_documents(folder_path):
-    """Read all markdown files from the data folder."""
-    documents = []
+def iter_documents(folder_path):
+    """Yield markdown files from the data folder one at a time."""
+    for file_path in sorted(Path(folder_path).glob("*.md")):
+        # Decoded from bytes (no newline translation) so chunk offsets match the file
+        content = file_path.read_bytes().decode("utf-8")
+        print(f"Loaded: {file_path.name}")
+        yield {
+            "content": content,
+            "filename": file_path.name
+        }
 
-    for file_path in Path(folder_path).glob("*.md"):
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            documents.append({
-                "content": content,
-                "filename": file_path.name
-            })
-            print(f"Loaded: {file_path.name}")
 
-    return documents
+def load_documents(folder_path):
+    """Read all markdown files from the data folder."""
+    return list(iter_documents(folder_path))
 
 
 # ============================================================
 # STEP 3: CHUNK DOCUMENTS (MARKDOWN-AWARE)
 # ============================================================
 
-def split_by_headings(text):
-    """Split markdown text into sections based on ## headings.
+def _strip_span(text, start, end):
+    """Narrow (start, end) the way text[start:end].strip() would, without copying."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _iter_line_starts(text, prefix, start, end):
+    """Yield the offset of every line in text[start:end] that begins with prefix.
+
+    str.find does the scanning, so lines that cannot match are never visited.
+    """
+    if text.startswith(prefix, start, end):
+        yield start
+    needle = "\n" + prefix
+    position = text.find(needle, start, end)
+    while position != -1:
+        yield position + 1
+        position = text.find(needle, position + 1, end)
+
+
+def _find_all(text, separator, start, end):
+    """Offsets of each non-overlapping separator in text[start:end], as str.split finds them."""
+    positions = []
+    position = text.find(separator, start, end)
+    while position != -1:
+        positions.append(position)
+        position = text.find(separator, position + len(separator), end)
+    return positions
+
+
+def _heading_name(text, line_start, end):
+    line_end = text.find("\n", line_start, end)
+    return text[line_start:end if line_end == -1 else line_end].lstrip("# ").strip()
+
+
+def _split_section(text, heading, start, end):
+    """Yield the stripped H2 section span, split at H3 boundaries if it exceeds CHUNK_SIZE."""
+    start, end = _strip_span(text, start, end)
+    if start == end:
+        return
+    heading = heading.strip()
+    if end - start <= CHUNK_SIZE:
+        yield heading, start, end
+        return
+
+    h3_heading = heading
+    h3_start = start
+    for line_start in _iter_line_starts(text, "### ", start, end):
+        span_start, span_end = _strip_span(text, h3_start, line_start)
+        if span_start < span_end:
+            yield h3_heading.strip(), span_start, span_end
+        h3_heading = f"{heading} > {_heading_name(text, line_start, end)}"
+        h3_start = line_start
+    span_start, span_end = _strip_span(text, h3_start, end)
+    if span_start < span_end:
+        yield h3_heading.strip(), span_start, span_end
+
+
+def iter_section_spans(text):
+    """Yield (heading, start, end) for each markdown section of text, in one pass.
 
     Keeps H2 sections intact (including H3 subsections).
-    Only splits a H2 section into H3-level chunks if it exceeds CHUNK_SIZE.
+    Only splits a H2 section into H3-level sections if it exceeds CHUNK_SIZE.
+    Spans are character offsets into text; no section text is copied.
     """
-    lines = text.split("\n")
     h1_title = ""
-    h2_sections = []
-    current_h2_heading = ""
-    current_h2_lines = []
-
-    def flush_h2():
-        content = "\n".join(current_h2_lines).strip()
-        if content:
-            h2_sections.append({
-                "heading": current_h2_heading.strip(),
-                "content": content
-            })
-
-    for line in lines:
-        if line.startswith("# ") and not line.startswith("## "):
+    heading = ""
+    section_start = 0
+
+    # Only heading lines matter; everything between them belongs to the current section
+    for line_start in _iter_line_starts(text, "#", 0, len(text)):
+        if text.startswith("# ", line_start):
             # H1 heading - capture title, start collecting
-            flush_h2()
-            h1_title = line.lstrip("# ").strip()
-            current_h2_heading = h1_title
-            current_h2_lines = [line]
-        elif line.startswith("## ") and not line.startswith("### "):
+            yield from _split_section(text, heading, section_start, line_start)
+            h1_title = _heading_name(text, line_start, len(text))
+            heading = h1_title
+            section_start = line_start
+        elif text.startswith("## ", line_start) and not text.startswith("### ", line_start):
             # H2 heading - start new section (includes all H3 children)
-            flush_h2()
-            h2_name = line.lstrip("# ").strip()
-            current_h2_heading = f"{h1_title} > {h2_name}" if h1_title else h2_name
-            current_h2_lines = [line]
-        else:
-            current_h2_lines.append(line)
+            yield from _split_section(text, heading, section_start, line_start)
+            h2_name = _heading_name(text, line_start, len(text))
+            heading = f"{h1_title} > {h2_name}" if h1_title else h2_name
+            section_start = line_start
 
-    flush_h2()
+    yield from _split_section(text, heading, section_start, len(text))
 
-    # Now split any oversized H2 sections at H3 boundaries
-    final_sections = []
-    for section in h2_sections:
-        if len(section["content"]) <= CHUNK_SIZE:
-            final_sections.append(section)
-        else:
-            # Split this H2 section at H3 boundaries
-            sub_lines = section["content"].split("\n")
-            current_h3_heading = section["heading"]
-            current_h3_lines = []
 
-            def flush_h3():
-                content = "\n".join(current_h3_lines).strip()
-                if content:
-                    final_sections.append({
-                        "heading": current_h3_heading.strip(),
-                        "content": content
-                    })
+def split_by_headings(text):
+    """Split markdown text into sections based on ## headings (see iter_section_spans)."""
+    return [
+        {"heading": heading, "content": text[start:end]}
+        for heading, start, end in iter_section_spans(text)
+    ]
+
+
+def iter_chunk_spans(text):
+    """Yield (chunk_id, heading, start, end) for every chunk of one markdown document."""
+    for i, (heading, start, end) in enumerate(iter_section_spans(text)):
+        if end - start <= CHUNK_SIZE:
+            yield str(i), heading, start, end
+            continue
+
+        # Section is too large: pack paragraphs (split on blank lines) into chunks.
+        # Counting the "\n\n" between them, paragraphs from chunk_start up to the
+        # one ending at para_end fit in a chunk while para_end - chunk_start <= CHUNK_SIZE
+        # (the first paragraph of a chunk always goes in), so each boundary is a bisect.
+        breaks = _find_all(text, "\n\n", start, end)
+        para_starts = [start] + [position + 2 for position in breaks]
+        para_ends = breaks + [end]
+        sub_id = 0
+        first = 0
+        while first < len(para_ends):
+            chunk_start = para_starts[first]
+            last = max(first + 1, bisect_right(para_ends, chunk_start + CHUNK_SIZE, first))
+            span_start, span_end = _strip_span(text, chunk_start, para_ends[last - 1])
+            if last < len(para_ends) or span_start < span_end:
+                yield f"{i}_{sub_id}", heading, span_start, span_end
+            sub_id += 1
+            first = last
+
+
+class _SourceCursor:
+    """Byte offset and line number of character positions, visited in increasing order."""
+
+    def __init__(self, text):
+        self.text = text
+        self.ascii = text.isascii()
+        self.position = 0
+        self.byte = 0
+        self.line = 1
+
+    def advance(self, position):
+        if self.ascii:
+            self.byte += position - self.position
+        else:
+            self.byte += len(self.text[self.position:position].encode("utf-8"))
+        self.line += self.text.count("\n", self.position, position)
+        self.position = position
+        return self.byte, self.line
 
-            for sline in sub_lines:
-                if sline.startswith("### "):
-                    flush_h3()
-                    h3_name = sline.lstrip("# ").strip()
-                    current_h3_heading = f"{section['heading']} > {h3_name}"
-                    current_h3_lines = [sline]
-                else:
-                    current_h3_lines.append(sline)
 
-            flush_h3()
+def iter_chunks(documents):
+    """Chunk documents by markdown sections, yielding chunks as they are produced.
 
-    return final_sections
+    Each chunk records its (start, end) character span in the document, the
+    matching byte offsets in the file and its first and last line; its text is
+    sliced out once, here, with no intermediate strings.
+    """
+    for doc in documents:
+        content = doc["content"]
+        cursor = _SourceCursor(content)
+        for chunk_id, heading, start, end in iter_chunk_spans(content):
+            byte_start, line_start = cursor.advance(start)
+            byte_end, line_end = cursor.advance(end)
+            yield {
+                "text": content[start:end],
+                "filename": doc["filename"],
+                "chunk_id": chunk_id,
+                "heading": heading,
+                "start": start,
+                "end": end,
+                "byte_start": byte_start,
+                "byte_end": byte_end,
+                "line_start": line_start,
+                "line_end": line_end,
+            }
 
 
 def chunk_documents(documents):
     """Chunk all documents by markdown sections."""
-    all_chunks = []
-
-    for doc in documents:
-        sections = split_by_headings(doc["content"])
-
-        for i, section in enumerate(sections):
-            text = section["content"]
-            heading = section["heading"]
-
-            # If section is too large, split it further
-            if len(text) > CHUNK_SIZE:
-                # Split on blank lines within the section
-                paragraphs = text.split("\n\n")
-                current_chunk = ""
-                sub_id = 0
-                for para in paragraphs:
-                    if current_chunk and len(current_chunk) + len(para) > CHUNK_SIZE:
-                        all_chunks.append({
-                            "text": current_chunk.strip(),
-                            "filename": doc["filename"],
-                            "chunk_id": f"{i}_{sub_id}",
-                            "heading": heading
-                        })
-                        sub_id += 1
-                        current_chunk = para + "\n\n"
-                    else:
-                        current_chunk += para + "\n\n"
-                if current_chunk.strip():
-                    all_chunks.append({
-                        "text": current_chunk.strip(),
-                        "filename": doc["filename"],
-                        "chunk_id": f"{i}_{sub_id}",
-                        "heading": heading
-                    })
-            else:
-                all_chunks.append({
-                    "text": text,
-                    "filename": doc["filename"],
-                    "chunk_id": str(i),
-                    "heading": heading
-                })
-
-    return all_chunks
+    return list(iter_chunks(documents))
 
 
 # ============================================================
 # STEP 4: CREATE EMBEDDINGS & STORE IN CHROMADB
 # ============================================================
 
-def create_vector_store(chunks):
-    """Embed chunks and store in ChromaDB."""
+def fingerprint_chunk(chunk, model_name=EMBEDDING_MODEL):
+    """Hash everything that affects a chunk's stored embedding and metadata."""
+    return fingerprint(model_name, chunk.get("heading", ""), chunk["text"])
+
+
+def start_embedding_pool(embedding_model, workers):
+    """Start a SentenceTransformer multi-process pool, or return None for in-process encoding."""
+    if workers <= 1:
+        return None
+
+    # Each worker is its own torch process; split the cores between them
+    # instead of letting every worker spin up one thread per core.
+    os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+    print(f"Starting {workers} embedding worker processes...")
+    return embedding_model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+
+def embed_texts(embedding_model, texts, batch_size=EMBED_BATCH_SIZE, pool=None):
+    """Embed texts in batches, sharding across the worker pool when one is given."""
+    if pool is not None and len(texts) > batch_size:
+        # sentence-transformers' default splits the texts into 10 pieces per
+        # worker, so 512 texts over 8 workers become forward passes of 7.
+        # Two pieces per worker of at least a full batch keep passes full.
+        n_workers = len(pool["processes"])
+        chunk_size = max(batch_size, -(-len(texts) // (2 * n_workers)))
+        return embedding_model.encode_multi_process(texts, pool, batch_size=batch_size, chunk_size=chunk_size)
+    return embedding_model.encode(texts, batch_size=batch_size)
+
+
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def max_chroma_batch_size(client):
+    """Largest number of records Chroma accepts in a single add/upsert call."""
+    if hasattr(client, "get_max_batch_size"):
+        return client.get_max_batch_size()
+    return getattr(client, "max_batch_size", INGEST_BATCH_SIZE)
+
+
+class _BatchEmbedder:
+    """Loads the embedding model (and worker pool) only once something needs embedding."""
+
+    def __init__(self, batch_size, workers, model=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.model = model
+        self.pool = None
+        self.count = 0
+        self.seconds = 0.0
+
+    def encode(self, texts):
+        if self.model is None:
+            # Load embedding model (runs locally, free)
+            print("\nLoading embedding model...")
+            self.model = SentenceTransformer(EMBEDDING_MODEL)
+        if self.pool is None and self.workers > 1:
+            self.pool = start_embedding_pool(self.model, self.workers)
+        start = time.perf_counter()
+        # float32 rows go straight to Chroma; a .tolist() round-trip only costs time
+        embeddings = list(embed_texts(self.model, texts, self.batch_size, self.pool))
+        self.seconds += time.perf_counter() - start
+        self.count += len(texts)
+        return embeddings
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+def store_batch(collection, chunks, hashes, embedder, store_documents=STORE_DOCUMENTS):
+    """Upsert one batch of chunks, embedding only those that are new or changed.
+
+    hashes holds fingerprint_chunk() for each chunk. Chunks whose content is
+    unchanged but whose position in the file moved only get their metadata
+    updated. With store_documents=False the chunk text is left out of Chroma
+    (source_text.py reads it back from the file).
+    Returns (unchanged, embedded, reused) counts for the batch.
+    """
+    texts = [chunk["text"] for chunk in chunks]
+    ids = [f"{chunk['filename']}_{chunk['chunk_id']}" for chunk in chunks]
+    metadatas = [
+        {
+            "filename": chunk["filename"],
+            "chunk_id": str(chunk["chunk_id"]),
+            "heading": chunk.get("heading", ""),
+            "content_hash": content_hash,
+            "source_start": chunk["byte_start"],
+            "source_end": chunk["byte_end"],
+            "line_start": chunk["line_start"],
+            "line_end": chunk["line_end"],
+        }
+        for chunk, content_hash in zip(chunks, hashes)
+    ]
+
+    # Compare against what is already stored for these IDs
+    existing = collection.get(ids=ids, include=["metadatas"])
+    stored = {
+        chunk_id: metadata or {}
+        for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])
+    }
+    changed = [i for i, chunk_id in enumerate(ids) if stored.get(chunk_id, {}).get("content_hash") != hashes[i]]
+    relocated = [
+        i for i, chunk_id in enumerate(ids)
+        if chunk_id in stored and stored[chunk_id].get("content_hash") == hashes[i] and stored[chunk_id] != metadatas[i]
+    ]
+    if relocated:
+        collection.update(ids=[ids[i] for i in relocated], metadatas=[metadatas[i] for i in relocated])
+    if not changed:
+        return len(ids), 0, 0
+
+    # A chunk that only moved (e.g. a section was inserted above it) keeps its
+    # hash under a different ID, so its stored embedding can be reused as-is.
+    reused_embeddings = {}
+    changed_hashes = sorted({hashes[i] for i in changed})
+    moved = collection.get(
+        where={"content_hash": {"$in": changed_hashes}},
+        include=["embeddings", "metadatas"],
+    )
+    for metadata, embedding in zip(moved["metadatas"], moved["embeddings"]):
+        reused_embeddings[metadata["content_hash"]] = np.asarray(embedding, dtype=np.float32)
+
+    to_embed = [i for i in changed if hashes[i] not in reused_embeddings]
+    new_embeddings = {}
+    if to_embed:
+        new_embeddings = dict(zip(to_embed, embedder.encode([texts[i] for i in to_embed])))
+
+    collection.upsert(
+        documents=[texts[i] for i in changed] if store_documents else None,
+        embeddings=[new_embeddings[i] if i in new_embeddings else reused_embeddings[hashes[i]] for i in changed],
+        ids=[ids[i] for i in changed],
+        metadatas=[metadatas[i] for i in changed]
+    )
+    return len(ids) - len(changed), len(to_embed), len(changed) - len(to_embed)
 
-    # Load embedding model (runs locally, free)
-    print("\nLoading embedding model...")
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
 
-    # Initialize ChromaDB
-    print("Initializing ChromaDB...")
-    client = chromadb.PersistentClient(path=CHROMA_PATH)
+def delete_orphans(collection, live_ids, page_size):
+    """Delete stored IDs that no longer correspond to any chunk in the documents.
 
-    # Delete existing collection if it exists (fresh start)
+    live_ids is anything that supports `in`: the BM25Index built during the
+    run, which keeps the IDs on disk rather than in one growing set.
+    """
+    orphaned_ids = []
+    offset = 0
+    while True:
+        page = collection.get(include=[], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        orphaned_ids.extend(chunk_id for chunk_id in page["ids"] if chunk_id not in live_ids)
+        offset += len(page["ids"])
+
+    for batch in iter_batches(orphaned_ids, page_size):
+        collection.delete(ids=batch)
+    return len(orphaned_ids)
+
+
+def parse_index_profile(spec):
+    """HNSW settings for a profile name or a "M=32,search_ef=100,space=cosine" spec."""
+    if spec in INDEX_PROFILES:
+        return {**HNSW_DEFAULTS, **INDEX_PROFILES[spec]}
+    settings = dict(HNSW_DEFAULTS)
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        key, _, value = part.partition("=")
+        if key not in HNSW_DEFAULTS or not value:
+            raise ValueError(
+                f"Bad index profile {spec!r}: use one of {', '.join(INDEX_PROFILES)} "
+                f"or key=value pairs with keys {', '.join(HNSW_DEFAULTS)}"
+            )
+        settings[key] = value if key == "space" else int(value)
+    if settings["space"] not in ("l2", "cosine", "ip"):
+        raise ValueError(f"Unknown space {settings['space']!r} (expected l2, cosine or ip)")
+    return settings
+
+
+def profile_metadata(spec):
+    """Collection metadata that creates the HNSW index with a profile's settings."""
+    settings = parse_index_profile(spec)
+    metadata = {f"hnsw:{key}": value for key, value in settings.items()}
+    # Chroma drops hnsw:space from the metadata on the next modify(), so keep a copy
+    metadata["space"] = settings["space"]
+    metadata["index_profile"] = spec
+    return metadata
+
+
+def collection_profile(metadata):
+    """HNSW settings a collection was created with (Chroma defaults for older collections)."""
+    metadata = metadata or {}
+    settings = {key: metadata.get(f"hnsw:{key}", default) for key, default in HNSW_DEFAULTS.items()}
+    settings["space"] = metadata.get("hnsw:space", metadata.get("space", "l2"))
+    return settings
+
+
+def reindex_collection(client, collection, metadata, page_size=INGEST_BATCH_SIZE):
+    """Rebuild a collection's HNSW index with new settings, copying the stored embeddings.
+
+    Records are copied page by page into a new collection, which then takes
+    the old one's name.
+    """
+    new_name = f"{COLLECTION_NAME}_reindex"
     try:
-        client.delete_collection(COLLECTION_NAME)
-        print(f"Deleted existing collection: {COLLECTION_NAME}")
-    except:
+        client.delete_collection(new_name)  # left over from an interrupted run
+    except Exception:
         pass
+    target = client.create_collection(name=new_name, metadata=metadata)
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        documents = page["documents"] if any(doc is not None for doc in page["documents"]) else None
+        target.add(ids=page["ids"], embeddings=page["embeddings"], documents=documents, metadatas=page["metadatas"])
+        offset += len(page["ids"])
+    client.delete_collection(COLLECTION_NAME)
+    target.modify(name=COLLECTION_NAME)
+    print(f"Rebuilt the HNSW index for {offset} chunks without re-embedding")
+    return client.get_collection(COLLECTION_NAME)
+
+
+def stamp_index_version(collection, index_version):
+    """Record which content the collection holds so caches built on it can tell when it changes."""
+    # Chroma refuses metadata updates that touch the distance space, so leave that out
+    metadata = {
+        key: value for key, value in (collection.metadata or {}).items()
+        if key != "hnsw:space"
+    }
+    metadata["index_version"] = index_version
+    collection.modify(metadata=metadata)
+
+
+def create_vector_store(chunks, rebuild=False, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS,
+                        client=None, embedding_model=None, store_documents=STORE_DOCUMENTS,
+                        index_profile=INDEX_PROFILE):
+    """Embed chunks and store in ChromaDB.
+
+    chunks can be any iterable (e.g. the iter_chunks generator); it is consumed
+    in fixed-size batches that are embedded and written one at a time, so peak
+    memory does not grow with the corpus. The BM25 index built alongside keeps
+    at most BM25_SEGMENT_DOCS chunks of postings in memory and spills the rest
+    to disk (see bm25_index.py); deleted IDs are found against those segments.
+
+    By default this is incremental: each chunk is fingerprinted, only new or
+    changed chunks are embedded and upserted, and IDs that no longer exist in
+    the documents are deleted. Because every batch is committed as it goes, a
+    crashed run can simply be re-run (without --rebuild) and picks up where it
+    stopped. Pass rebuild=True to start from an empty collection.
+
+    An already-open Chroma client and/or loaded embedding model can be passed
+    in (app.py does this) so they are not opened or loaded a second time.
+
+    With store_documents=False only embeddings and metadata are stored; the
+    chunk text is read back from the source files (see source_text.py).
+    Changing this setting rebuilds the collection.
+
+    index_profile picks the HNSW settings (a name from INDEX_PROFILES or a
+    key=value spec). None keeps whatever the collection already uses. If it
+    differs from the existing collection's settings, the index is rebuilt
+    from the stored embeddings.
+    """
+
+    # Initialize ChromaDB
+    if client is None:
+        print("Initializing ChromaDB...")
+        client = chromadb.PersistentClient(path=CHROMA_PATH)
 
-    # Create new collection
-    collection = client.create_collection(
+    try:
+        existing = client.get_collection(COLLECTION_NAME)
+    except Exception:
+        existing = None
+    if not rebuild and existing is not None:
+        if (existing.metadata or {}).get("store_documents", True) != store_documents:
+            print("Document storage setting changed, rebuilding the collection...")
+            rebuild = True
+
+    if index_profile is None:
+        # Keep the existing settings (Chroma defaults for a new collection)
+        index_profile = (existing.metadata or {}).get("index_profile", "default") if existing else "default"
+    hnsw_metadata = profile_metadata(index_profile)
+    if not rebuild and existing is not None:
+        if collection_profile(existing.metadata) != parse_index_profile(index_profile):
+            print(f"Index profile changed to {index_profile!r}, rebuilding the HNSW index...")
+            metadata = {k: v for k, v in (existing.metadata or {}).items() if not k.startswith("hnsw:")}
+            reindex_collection(client, existing, {**metadata, **hnsw_metadata})
+
+    if rebuild:
+        # Delete existing collection if it exists (fresh start)
+        try:
+            client.delete_collection(COLLECTION_NAME)
+            print(f"Deleted existing collection: {COLLECTION_NAME}")
+        except Exception:
+            pass
+
+    collection = client.get_or_create_collection(
         name=COLLECTION_NAME,
-        metadata={"description": "StayEasy documentation"}
+        metadata={"description": "StayEasy documentation", "store_documents": store_documents, **hnsw_metadata}
     )
 
-    # Prepare data for ChromaDB
-    texts = [chunk["text"] for chunk in chunks]
-    ids = [f"{chunk['filename']}_{chunk['chunk_id']}" for chunk in chunks]
-    metadatas = [{"filename": chunk["filename"], "chunk_id": str(chunk["chunk_id"]), "heading": chunk.get("heading", "")} for chunk in chunks]
-
-    # Create embeddings
-    print(f"Creating embeddings for {len(texts)} chunks...")
-    embeddings = embedding_model.encode(texts).tolist()
-
-    # Add to ChromaDB
-    collection.add(
-        documents=texts,
-        embeddings=embeddings,
-        ids=ids,
-        metadatas=metadatas
-    )
+    # With a worker pool, every worker gets INGEST_BATCH_SIZE chunks per round
+    # instead of sharing one batch between them
+    write_batch_size = min(INGEST_BATCH_SIZE * max(1, workers), max_chroma_batch_size(client))
+    embedder = _BatchEmbedder(batch_size, workers, embedding_model)
+    bm25 = BM25Index()  # also answers "is this ID still in the documents?" for delete_orphans
+    version_digest = hashlib.sha256()
+    unchanged_count = embedded_count = reused_count = 0
 
-    print(f"Stored {len(texts)} chunks in ChromaDB")
+    try:
+        for batch in iter_batches(chunks, write_batch_size):
+            hashes = [fingerprint_chunk(chunk) for chunk in batch]
+            for chunk, content_hash in zip(batch, hashes):
+                chunk_id = f"{chunk['filename']}_{chunk['chunk_id']}"
+                bm25.add(chunk_id, chunk["text"])
+                version_digest.update(
+                    f"{chunk_id}:{content_hash}:{chunk['byte_start']}:{chunk['byte_end']}\n".encode("utf-8")
+                )
+            unchanged, embedded, reused = store_batch(collection, batch, hashes, embedder, store_documents)
+            unchanged_count += unchanged
+            embedded_count += embedded
+            reused_count += reused
+    finally:
+        embedder.close()
+
+    deleted_count = delete_orphans(collection, bm25, write_batch_size)
+    index_version = version_digest.hexdigest()[:16]
+    stamp_index_version(collection, index_version)
+
+    # Keyword index for hybrid search, tagged with the same version as the collection
+    bm25.index_version = index_version
+    n_terms = bm25.save(BM25_PATH)
+    print(f"Saved BM25 index ({n_terms} terms) to {BM25_PATH}")
+
+    if embedder.count:
+        print(f"Embedded {embedder.count} chunks in {embedder.seconds:.1f}s "
+              f"({embedder.count / max(embedder.seconds, 1e-9):.1f} chunks/sec)")
+    print(
+        f"Unchanged: {unchanged_count}, embedded: {embedded_count}, "
+        f"reused: {reused_count}, deleted: {deleted_count}"
+    )
+    print(f"Stored {collection.count()} chunks in ChromaDB")
     return collection
 
 
@@ -217,28 +632,56 @@ def create_vector_store(chunks):
 # MAIN: RUN THE PIPELINE
 # ============================================================
 
+def log_chunks(chunks):
+    """Print each chunk's breakdown as it streams past."""
+    for chunk in chunks:
+        print(f"  [{chunk['filename']}] {chunk['heading'][:60]} ({len(chunk['text'])} chars)")
+        yield chunk
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Ingest StayEasy documents into ChromaDB")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="delete the collection and re-embed every chunk")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS,
+                        help="number of CPU processes used for embedding")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="sentences per embedding forward pass")
+    parser.add_argument("--no-documents", action="store_true", default=not STORE_DOCUMENTS,
+                        help="store only embeddings and metadata; chunk text is read from data/ on demand")
+    parser.add_argument("--export-index", choices=["float32", "float16", "int8"],
+                        help="also write a compact copy for RETRIEVAL_BACKEND=compact")
+    parser.add_argument("--pca", type=int, metavar="DIM",
+                        help="with --export-index, reduce vectors to DIM dimensions first")
+    parser.add_argument("--index-profile", default=INDEX_PROFILE, metavar="PROFILE",
+                        help=f"HNSW settings: {', '.join(INDEX_PROFILES)} or e.g. \"M=32,search_ef=100\" "
+                             "(default: keep the current ones)")
+    args = parser.parse_args()
+    if args.index_profile:
+        try:
+            parse_index_profile(args.index_profile)
+        except ValueError as exc:
+            parser.error(str(exc))
+
     print("=" * 50)
     print("StayEasy RAG - Document Ingestion")
     print("=" * 50)
 
-    # Step 1: Load documents
-    print("\n[Step 1] Loading documents...")
-    documents = load_documents(DATA_FOLDER)
-    print(f"Loaded {len(documents)} documents")
+    # Step 1 + 2: Stream documents and chunk them by markdown sections
+    print("\n[Step 1-2] Streaming documents and chunking by markdown sections...")
+    documents = iter_documents(DATA_FOLDER)
+    chunks = log_chunks(iter_chunks(documents))
 
-    # Step 2: Chunk documents by markdown sections
-    print("\n[Step 2] Chunking documents by markdown sections...")
-    chunks = chunk_documents(documents)
-    print(f"Created {len(chunks)} chunks")
-
-    # Show chunk breakdown
-    for chunk in chunks:
-        print(f"  [{chunk['filename']}] {chunk['heading'][:60]} ({len(chunk['text'])} chars)")
-
-    # Step 3: Embed and store
+    # Step 3: Embed and store, one batch at a time
     print("\n[Step 3] Creating embeddings and storing in ChromaDB...")
-    collection = create_vector_store(chunks)
+    collection = create_vector_store(
+        chunks, rebuild=args.rebuild, batch_size=args.batch_size, workers=args.workers,
+        store_documents=not args.no_documents, index_profile=args.index_profile,
+    )
+
+    if args.export_index:
+        print("\n[Step 4] Exporting compact search index...")
+        export_index(collection, args.export_index, args.pca)
 
     print("\n" + "=" * 50)
     print("Ingestion complete!")
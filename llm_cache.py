@@ -0,0 +1,101 @@
+"""
+llm_cache.py - Content-addressed disk cache for evaluation LLM calls
+
+evaluate.py generates an answer and asks the judge model to score it for
+every test case on every run. With temperature 0 the same request gives the
+same answer, so responses are stored on disk under a hash of the full request
+(model, temperature, max_tokens and the complete message list). A re-run
+only calls the API for cases whose prompt actually changed, e.g. because
+retrieval returned different chunks.
+
+Each response is one small JSON file, llm_cache/<hash[:2]>/<hash>.json,
+written atomically, so concurrent evaluation threads never see a partial
+entry.
+
+Settings (environment variables):
+    LLM_CACHE_DIR   where responses are stored (default llm_cache)
+    LLM_CACHE       "1" (default) to use the cache, "0" to always call the API
+"""
+
+import os
+import json
+import hashlib
+import threading
+import uuid
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "llm_cache")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+
+
+# ============================================================
+# CACHE
+# ============================================================
+
+def request_key(**request):
+    """sha256 of a chat completion request; key order and whitespace do not matter."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Chat completion responses stored on disk, one file per request hash."""
+
+    def __init__(self, path=LLM_CACHE_DIR, enabled=LLM_CACHE_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), "r", encoding="utf-8") as f:
+                return json.load(f)["content"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, content, request=None):
+        file_path = self._file(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"request": request, "content": content}, f)
+        os.replace(tmp_path, file_path)
+
+    def complete(self, client, **request):
+        """client.chat.completions.create(**request) -> message content, served from disk when possible."""
+        key = request_key(**request)
+        if self.enabled:
+            content = self.get(key)
+            if content is not None:
+                with self._lock:
+                    self.hits += 1
+                return content
+
+        response = client.chat.completions.create(**request)
+        content = response.choices[0].message.content
+        with self._lock:
+            self.misses += 1
+        if self.enabled and content is not None:
+            self.put(key, content, request)
+        return content
+
+    def stats(self):
+        with self._lock:
+            calls = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / calls if calls else 0.0,
+            }
+
+
+# One cache per process (evaluate.py configures it from --no-cache)
+llm_cache = LLMCache()
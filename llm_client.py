@@ -0,0 +1,121 @@
+"""
+llm_client.py - One shared OpenAI client per process
+
+Creating OpenAI() on every call throws away the HTTP connection pool, so each
+answer paid for a fresh TCP + TLS handshake. Everything now goes through
+get_client(), which keeps connections alive between calls. Async callers
+(the Gradio chat handler) use get_async_client(), which has its own pool with
+the same settings.
+
+Failed requests (connection errors, timeouts, 429 and 5xx) are retried by the
+OpenAI SDK with exponential backoff plus random jitter.
+
+Settings (environment variables):
+    OPENAI_API_KEY          API key (read by the OpenAI SDK)
+    OPENAI_BASE_URL         send requests somewhere else, e.g. a local stand-in server
+    OPENAI_TIMEOUT          seconds before a request is abandoned (default 30)
+    OPENAI_MAX_RETRIES      retries per request (default 3)
+    OPENAI_MAX_CONNECTIONS  size of the keep-alive connection pool (default 64)
+"""
+
+import os
+import threading
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+KEEPALIVE_EXPIRY = 60  # seconds an idle connection is kept open
+
+_client = None
+_async_client = None
+_client_settings = {}  # from configure(); used for clients created later
+_lock = threading.Lock()
+
+
+# ============================================================
+# CLIENT
+# ============================================================
+
+def _limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def create_client(base_url=None, api_key=None, timeout=TIMEOUT, max_retries=MAX_RETRIES):
+    """Build an OpenAI client backed by a keep-alive connection pool."""
+    # Imported here so scripts that never reach the LLM don't pay for the import
+    from openai import OpenAI, DefaultHttpxClient
+
+    return OpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=DefaultHttpxClient(limits=_limits()),
+    )
+
+
+def create_async_client(base_url=None, api_key=None, timeout=TIMEOUT, max_retries=MAX_RETRIES):
+    """Build an AsyncOpenAI client backed by a keep-alive connection pool."""
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    return AsyncOpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=DefaultAsyncHttpxClient(limits=_limits()),
+    )
+
+
+def get_client():
+    """Return the process-wide OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_client(**_client_settings)
+    return _client
+
+
+def get_async_client():
+    """Return the process-wide AsyncOpenAI client, creating it on first use.
+
+    Like the connection pool inside it, the client belongs to the event loop
+    that first uses it (Gradio runs all async handlers on one loop).
+    """
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = create_async_client(**_client_settings)
+    return _async_client
+
+
+def set_client(client):
+    """Replace the shared client, e.g. with one pointing at a local stand-in server.
+
+    Returns the previous client so callers can restore it.
+    """
+    global _client
+    with _lock:
+        previous, _client = _client, client
+    return previous
+
+
+def configure(base_url=None, api_key=None, **kwargs):
+    """Point the shared clients (sync and async) at another OpenAI-compatible server."""
+    global _client_settings, _async_client
+    with _lock:
+        _client_settings = {"base_url": base_url, "api_key": api_key, **kwargs}
+        # Recreated with the new settings on next use
+        _async_client = None
+    return set_client(create_client(**_client_settings))
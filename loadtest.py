@@ -0,0 +1,512 @@
+"""
+loadtest.py - How many concurrent chat users can one app.py process sustain?
+
+Drives app.chat_respond_async() (the handler the Gradio chat tab runs) on one
+event loop, or with --sync the thread-based app.chat_respond(), against the
+local fake OpenAI server in fake_openai.py by default, so it runs offline and
+costs nothing. Reports:
+  - throughput (completed chats per second)
+  - latency p50 / p95 / p99: until the sources are shown, until the first
+    answer token, and until the answer is complete
+  - per-stage latency (embed, search, answer_cache, llm_first_token, llm)
+    and error rates, taken from the request traces (see metrics.py)
+
+Closed loop (default): --concurrency users, each sending the next question
+as soon as the previous answer is complete. Open loop (--rate): new chats
+arrive at random (Poisson) times at the given average rate; latency is then
+measured from the arrival time, so waiting for a free worker counts.
+
+With --api-workers, the chats go over HTTP to api.py instead (streamed
+POST /answer), started once per worker count with the fake LLM, so the
+same load measures how the API scales across cores, e.g. 1 vs 4 workers.
+The workers search the exported index (python ingest.py --export-index
+float32); stage timings stay in the workers, so only end-to-end latency is
+reported in this mode.
+
+Run:
+    python loadtest.py                                   # 8 users, 200 chats, fake LLM
+    python loadtest.py --concurrency 32 --requests 1000
+    python loadtest.py --rate 10 --duration 60 --concurrency 64
+    python loadtest.py --latency-ms 800 --tokens-per-sec 30 --error-rate 0.02
+    python loadtest.py --sync --concurrency 32               # compare with the blocking handler
+    python loadtest.py --base-url https://api.openai.com/v1   # real API (costs money)
+    python loadtest.py --api-workers 1,4 --concurrency 32     # API throughput at 1 and 4 workers
+"""
+
+import os
+import sys
+import json
+import socket
+import asyncio
+import time
+import random
+import argparse
+import platform
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# One JSON log line per chat would bury the report
+os.environ.setdefault("TRACE_LOG", "0")
+
+import llm_client
+import fake_openai
+from metrics import trace_listeners
+from benchmark import percentile, git_commit
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS = 200
+OUTPUT_PATH = "loadtest_results.json"
+STAGES = ["embed", "search", "answer_cache", "llm_first_token", "llm"]
+API_START_TIMEOUT = 300  # seconds to wait for every API worker to report ready
+
+
+# ============================================================
+# LOAD GENERATION
+# ============================================================
+
+class ChatRecorder:
+    """Timings (seconds from arrival) and the error, if any, of one chat as its updates arrive.
+
+    arrived=None means the chat starts now (closed loop), so nothing was queued.
+    """
+
+    def __init__(self, arrived):
+        self.arrived = arrived or time.perf_counter()
+        self.queued = time.perf_counter() - self.arrived
+        self.stage = "retrieve"
+        self.sources_at = self.first_token_at = None
+
+    def on_update(self, history):
+        """The handler yielded: first with the sources, then with each piece of the answer."""
+        now = time.perf_counter()
+        if self.sources_at is None:
+            self.sources_at = now
+            self.stage = "answer"
+        elif self.first_token_at is None and history[-1]["content"]:
+            self.first_token_at = now
+
+    def finish(self, exc=None):
+        """The result dict, once the chat has ended (with exc if it raised)."""
+        finished = time.perf_counter()
+        answered = self.sources_at is not None and exc is None
+        return {
+            "queued": self.queued,
+            "error": type(exc).__name__ if exc is not None else None,
+            "error_stage": self.stage if exc is not None else None,
+            "total": finished - self.arrived,
+            "sources": self.sources_at - self.arrived if self.sources_at else None,
+            "first_token": (self.first_token_at or finished) - self.arrived if answered else None,
+        }
+
+
+def run_chat(chat_respond, question, arrived):
+    """Run one chat to completion; returns its ChatRecorder result."""
+    recorder = ChatRecorder(arrived)
+    try:
+        for _, history, _ in chat_respond(question, []):
+            recorder.on_update(history)
+    except Exception as exc:
+        return recorder.finish(exc)
+    return recorder.finish()
+
+
+async def run_chat_async(chat_respond_async, question, arrived):
+    """run_chat() for the async handler."""
+    recorder = ChatRecorder(arrived)
+    try:
+        async for _, history, _ in chat_respond_async(question, []):
+            recorder.on_update(history)
+    except Exception as exc:
+        return recorder.finish(exc)
+    return recorder.finish()
+
+
+def arrival_times(n_requests, rate, rng):
+    """Offsets (seconds from start) of each arrival: all at once, or a Poisson process at rate per second."""
+    if not rate:
+        return [0.0] * n_requests
+    offsets, t = [], 0.0
+    for _ in range(n_requests):
+        t += rng.expovariate(rate)
+        offsets.append(t)
+    return offsets
+
+
+def run_load(chat_respond, questions, n_requests, concurrency, rate=0.0, seed=0):
+    """Send n_requests chats with at most concurrency in flight; returns (results, wall seconds)."""
+    rng = random.Random(seed)
+    schedule = arrival_times(n_requests, rate, rng)
+    results = [None] * n_requests
+    completed = [0]
+    lock = threading.Lock()
+
+    def job(i, arrived):
+        results[i] = run_chat(chat_respond, questions[i % len(questions)], arrived)
+        with lock:
+            completed[0] += 1
+            if completed[0] % max(1, n_requests // 10) == 0:
+                print(f"  {completed[0]}/{n_requests} chats done")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, offset in enumerate(schedule):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Closed loop: the pool size caps concurrency and timing starts when a worker is free
+            pool.submit(job, i, start + offset if rate else None)
+    return results, time.perf_counter() - start
+
+
+async def run_load_async(chat_respond_async, questions, n_requests, concurrency, rate=0.0, seed=0):
+    """run_load() on one event loop; a semaphore plays the part of Gradio's concurrency_limit."""
+    rng = random.Random(seed)
+    schedule = arrival_times(n_requests, rate, rng)
+    slots = asyncio.Semaphore(concurrency)
+    completed = [0]
+
+    async def job(i, arrived):
+        async with slots:
+            result = await run_chat_async(chat_respond_async, questions[i % len(questions)], arrived)
+        completed[0] += 1
+        if completed[0] % max(1, n_requests // 10) == 0:
+            print(f"  {completed[0]}/{n_requests} chats done")
+        return result
+
+    start = time.perf_counter()
+    tasks = []
+    for i, offset in enumerate(schedule):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(job(i, start + offset if rate else None)))
+    results = await asyncio.gather(*tasks)
+    return list(results), time.perf_counter() - start
+
+
+# ============================================================
+# API MODE
+# ============================================================
+
+class APIStreamError(Exception):
+    """An "error" event in a streamed /answer response."""
+
+
+def api_chat(client, api_url):
+    """A chat_respond() look-alike that streams one answer from api.py's POST /answer."""
+    def chat_respond(question, history):
+        body = {"question": question, "stream": True}
+        with client.stream("POST", f"{api_url}/answer", json=body) as response:
+            response.raise_for_status()
+            answer, event = "", None
+            for line in response.iter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "sources":
+                        yield "", history + [{"role": "assistant", "content": ""}], data
+                    elif event == "token":
+                        answer += data["text"]
+                        yield "", history + [{"role": "assistant", "content": answer}], None
+                    elif event == "error":
+                        raise APIStreamError(data["detail"])
+    return chat_respond
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_api(workers, llm_base_url, client):
+    """Start api.py with this many workers against the given LLM; returns (process, URL) once all are ready."""
+    port = _free_port()
+    env = {
+        **os.environ,
+        "API_PORT": str(port),
+        "OPENAI_BASE_URL": llm_base_url,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "fake-key"),
+        "OPENAI_MAX_RETRIES": "0",
+        "RETRIEVAL_BACKEND": "compact",
+        "METRICS_PORT": "0",
+        "TRACE_LOG": "0",
+    }
+    api_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.py")
+    process = subprocess.Popen([sys.executable, api_script, "--workers", str(workers)], env=env)
+    api_url = f"http://127.0.0.1:{port}"
+    # /readyz is answered by whichever worker accepts the connection, so poll
+    # until every worker's pid has been seen ready
+    ready_pids = set()
+    deadline = time.monotonic() + API_START_TIMEOUT
+    while len(ready_pids) < workers:
+        if process.poll() is not None:
+            raise RuntimeError(f"api.py exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f"api.py workers not ready after {API_START_TIMEOUT}s")
+        try:
+            response = client.get(f"{api_url}/readyz", headers={"Connection": "close"})
+            body = response.json()
+            if body["status"] == "failed":
+                process.terminate()
+                raise RuntimeError(f"api.py failed to load: {body.get('error')}")
+            if response.status_code == 200:
+                ready_pids.add(body["pid"])
+                continue
+        except Exception as exc:
+            if isinstance(exc, RuntimeError):
+                raise
+        time.sleep(0.2)
+    return process, api_url
+
+
+def run_api_scaling(worker_counts, llm_base_url, questions, n_requests, concurrency, rate):
+    """Run the same load against api.py at each worker count; returns {workers: report}."""
+    import httpx
+
+    reports = {}
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    with httpx.Client(timeout=60, limits=limits) as client:
+        for workers in worker_counts:
+            print(f"\nStarting api.py with {workers} worker{'s' if workers > 1 else ''}...")
+            process, api_url = start_api(workers, llm_base_url, client)
+            try:
+                print(f"Sending {n_requests} chats to {api_url}/answer (up to {concurrency} at once)...")
+                results, wall_seconds = run_load(api_chat(client, api_url), questions, n_requests, concurrency, rate)
+            finally:
+                process.terminate()
+                process.wait()
+            report = build_report(results, [], wall_seconds, n_requests)
+            print_report(report)
+            reports[workers] = report
+    return reports
+
+
+# ============================================================
+# REPORT
+# ============================================================
+
+def summarize(values):
+    values = [v * 1000 for v in values if v is not None]
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+        "max": round(max(values), 1) if values else 0.0,
+    }
+
+
+def build_report(results, traces, wall_seconds, n_requests):
+    ok = [r for r in results if not r["error"]]
+    errors_by_stage = {}
+    for trace in traces:
+        for stage in trace.errors:
+            errors_by_stage[stage] = errors_by_stage.get(stage, 0) + 1
+    # Failures outside any traced stage still count, under the step that was running
+    untraced = len(results) - len(ok) - sum(1 for trace in traces if trace.errors)
+    for result in results:
+        if untraced <= 0:
+            break
+        if result["error"]:
+            errors_by_stage[result["error_stage"]] = errors_by_stage.get(result["error_stage"], 0) + 1
+            untraced -= 1
+
+    stages = {}
+    for stage in STAGES:
+        timings = [trace.spans[stage] for trace in traces if stage in trace.spans]
+        if timings or stage in errors_by_stage:
+            stages[stage] = {
+                **summarize(timings),
+                "errors": errors_by_stage.get(stage, 0),
+                "error_rate": round(errors_by_stage.get(stage, 0) / max(n_requests, 1), 4),
+            }
+    for stage, count in errors_by_stage.items():
+        stages.setdefault(stage, {"errors": count, "error_rate": round(count / max(n_requests, 1), 4)})
+
+    return {
+        "requests": n_requests,
+        "completed": len(ok),
+        "failed": n_requests - len(ok),
+        "error_rate": round((n_requests - len(ok)) / max(n_requests, 1), 4),
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_per_sec": round(len(ok) / max(wall_seconds, 1e-9), 2),
+        "latency_ms": {
+            "sources": summarize([r["sources"] for r in ok]),
+            "first_token": summarize([r["first_token"] for r in ok]),
+            "total": summarize([r["total"] for r in ok]),
+            "queued": summarize([r["queued"] for r in results]),
+        },
+        "stages_ms": stages,
+        "errors": sorted({r["error"] for r in results if r["error"]}),
+    }
+
+
+def print_report(report):
+    print(f"\n{'=' * 60}")
+    print(f"  LOAD TEST RESULTS")
+    print(f"{'=' * 60}")
+    print(f"  Chats:       {report['completed']}/{report['requests']} completed "
+          f"({report['error_rate']:.1%} failed) in {report['wall_seconds']}s")
+    print(f"  Throughput:  {report['throughput_per_sec']} chats/sec")
+    print(f"\n  {'latency (ms)':<18} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, stats in report["latency_ms"].items():
+        print(f"  {name:<18} {stats['p50']:>8} {stats['p95']:>8} {stats['p99']:>8} {stats['max']:>8}")
+    print(f"\n  {'stage (ms)':<18} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>8}")
+    for name, stats in report["stages_ms"].items():
+        print(f"  {name:<18} {stats.get('p50', '-'):>8} {stats.get('p95', '-'):>8} "
+              f"{stats.get('p99', '-'):>8} {stats['errors']:>8}")
+    if report["errors"]:
+        print(f"\n  Error types: {', '.join(report['errors'])}")
+    print(f"{'=' * 60}")
+
+
+def write_results(path, config, results):
+    with open(path, "w") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+            "config": config,
+            "results": results,
+        }, f, indent=2)
+    print(f"\n  Results saved to: {path}")
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the StayEasy chat handler")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="max chats in flight")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="number of chats to send")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="open loop: average new chats per second (default: closed loop)")
+    parser.add_argument("--duration", type=float, default=0.0,
+                        help="with --rate, send rate x duration chats instead of --requests")
+    parser.add_argument("--base-url", default=None,
+                        help="OpenAI-compatible API to use instead of the bundled fake server")
+    parser.add_argument("--latency-ms", type=float, default=fake_openai.LATENCY_MS,
+                        help="fake server: delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=fake_openai.TOKENS_PER_SEC,
+                        help="fake server: streaming rate")
+    parser.add_argument("--tokens", type=int, default=fake_openai.COMPLETION_TOKENS,
+                        help="fake server: tokens per answer")
+    parser.add_argument("--error-rate", type=float, default=fake_openai.ERROR_RATE,
+                        help="fake server: fraction of LLM requests that fail")
+    parser.add_argument("--sync", action="store_true",
+                        help="drive the blocking chat_respond() from a thread pool instead of the async handler")
+    parser.add_argument("--use-caches", action="store_true",
+                        help="keep the query embedding and answer caches on (repeated questions get cheaper)")
+    parser.add_argument("--api-workers", default=None,
+                        help="comma-separated worker counts: load test api.py over HTTP at each (e.g. 1,4)")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="where to write the JSON results")
+    args = parser.parse_args()
+    n_requests = int(args.rate * args.duration) if args.rate and args.duration else args.requests
+
+    print("=" * 60)
+    print("  StayEasy RAG - Load Test")
+    print("=" * 60)
+
+    if args.base_url:
+        llm_client.configure(base_url=args.base_url)
+        print(f"LLM: {args.base_url}")
+        llm_base_url = args.base_url
+    else:
+        server = fake_openai.start_fake_server(
+            latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec,
+            tokens=args.tokens, error_rate=args.error_rate,
+        )
+        # No retries: a simulated failure should show up as an error, not as extra latency
+        llm_client.configure(base_url=server.base_url, api_key="fake-key", max_retries=0)
+        print(f"LLM: fake server at {server.base_url} ({args.latency_ms:.0f} ms to first token, "
+              f"{args.tokens} tokens at {args.tokens_per_sec:.0f}/s, {args.error_rate:.0%} errors)")
+        llm_base_url = server.base_url
+
+    config = {
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "llm": args.base_url or "fake",
+        **({} if args.base_url else {
+            "fake_latency_ms": args.latency_ms,
+            "fake_tokens_per_sec": args.tokens_per_sec,
+            "fake_tokens": args.tokens,
+            "fake_error_rate": args.error_rate,
+        }),
+    }
+
+    if args.api_workers:
+        from evaluate import TEST_CASES
+
+        worker_counts = [int(n) for n in args.api_workers.split(",")]
+        questions = [test["question"] for test in TEST_CASES]
+        reports = run_api_scaling(worker_counts, llm_base_url, questions, n_requests, args.concurrency, args.rate)
+        base = reports[worker_counts[0]]["throughput_per_sec"]
+        print(f"\n  {'workers':<10} {'chats/sec':>10} {'scaling':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for workers, report in reports.items():
+            print(f"  {workers:<10} {report['throughput_per_sec']:>10} "
+                  f"{report['throughput_per_sec'] / max(base, 1e-9):>7.2f}x "
+                  f"{report['latency_ms']['total']['p50']:>8} {report['latency_ms']['total']['p95']:>8}")
+        write_results(args.output, {**config, "handler": "api", "cpus": os.cpu_count()},
+                      {str(workers): report for workers, report in reports.items()})
+        return 0 if all(report["completed"] for report in reports.values()) else 1
+
+    # Importing app loads the model and the vector database, like starting the server
+    import app
+    from answer_cache import SemanticAnswerCache
+    from embedding_cache import query_cache
+
+    # Never write fake answers into answer_cache.json
+    app.answer_cache = SemanticAnswerCache(
+        path=None, index_version=app.answer_cache.index_version,
+        max_entries=app.answer_cache.max_entries if args.use_caches else 0,
+    )
+    if not args.use_caches:
+        query_cache.maxsize = 0
+        query_cache.clear()
+
+    traces = []
+    trace_lock = threading.Lock()
+
+    def collect(trace, total):
+        if trace.name == "chat":
+            with trace_lock:
+                traces.append(trace)
+
+    trace_listeners.append(collect)
+    questions = [test["question"] for test in app.TEST_CASES]
+
+    mode = f"open loop, {args.rate}/s arrivals" if args.rate else "closed loop"
+    handler = "chat_respond" if args.sync else "chat_respond_async"
+    print(f"\nSending {n_requests} chats to {handler} ({mode}, up to {args.concurrency} at once)...")
+    if args.sync:
+        results, wall_seconds = run_load(app.chat_respond, questions, n_requests, args.concurrency, args.rate)
+    else:
+        results, wall_seconds = asyncio.run(
+            run_load_async(app.chat_respond_async, questions, n_requests, args.concurrency, args.rate)
+        )
+    trace_listeners.remove(collect)
+
+    report = build_report(results, traces, wall_seconds, n_requests)
+    print_report(report)
+
+    write_results(args.output, {
+        **config,
+        "handler": handler,
+        "stream_answers": app.STREAM_ANSWERS,
+        "use_caches": args.use_caches,
+    }, report)
+    return 0 if report["completed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+metrics.py - Per-stage latency tracing and a Prometheus-style metrics endpoint
+
+Each chat request gets a Trace. Stages (query embedding, vector search, LLM
+call, ...) are timed with trace.span("name"), and token usage is recorded from
+the OpenAI response. Every span also feeds a process-wide histogram, and the
+finished trace is logged as one JSON line.
+
+    GET http://localhost:9100/metrics   -> Prometheus text format
+
+Settings (environment variables):
+    METRICS_PORT   port for the metrics endpoint (default 9100, 0 disables)
+    TRACE_LOG      "1" (default) to log one JSON line per request, "0" to stop
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+TRACE_LOG = os.getenv("TRACE_LOG", "1") != "0"
+
+# Latency buckets in seconds, from a cached embedding up to a slow LLM answer
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger("stayeasy.trace")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# ============================================================
+# METRIC TYPES
+# ============================================================
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.total += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.total, self.sum
+
+
+class Registry:
+    """Named histograms and counters, each keyed by a single label value."""
+
+    def __init__(self):
+        self.histograms = {}   # (name, label) -> Histogram
+        self.counters = {}     # (name, label) -> float
+        self.gauges = {}       # name -> (help, callable returning {label: value})
+        self.help = {}
+        self.label_names = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, label, help_text="", label_name="stage", buckets=LATENCY_BUCKETS):
+        key = (name, label)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+                self.help.setdefault(name, help_text)
+                self.label_names.setdefault(name, label_name)
+            return self.histograms[key]
+
+    def inc(self, name, label, amount=1, help_text="", label_name="kind"):
+        with self._lock:
+            self.counters[(name, label)] = self.counters.get((name, label), 0) + amount
+            self.help.setdefault(name, help_text)
+            self.label_names.setdefault(name, label_name)
+
+    def register_gauge(self, name, help_text, read):
+        """read() returns {label_value: number}; it is called at scrape time."""
+        with self._lock:
+            self.gauges[name] = (help_text, read)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        seen = set()
+        for (name, label), histogram in histograms:
+            if name not in seen:
+                lines += [f"# HELP {name} {self.help.get(name, '')}", f"# TYPE {name} histogram"]
+                seen.add(name)
+            counts, total, total_sum = histogram.snapshot()
+            labels = f'{self.label_names[name]}="{label}"'
+            for bound, count in zip(histogram.buckets, counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total}')
+            lines.append(f'{name}_sum{{{labels}}} {total_sum:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {total}')
+        for (name, label), value in counters:
+            if name not in seen:
+                lines += [f"# HELP {name} {self.help.get(name, '')}", f"# TYPE {name} counter"]
+                seen.add(name)
+            lines.append(f'{name}{{{self.label_names[name]}="{label}"}} {value}')
+        for name, (help_text, read) in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for label, value in read().items():
+                lines.append(f'{name}{{kind="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Called with (trace, total_seconds) whenever a trace finishes, e.g. by loadtest.py
+trace_listeners = []
+
+
+# ============================================================
+# TRACING
+# ============================================================
+
+class Trace:
+    """Timings and token counts for one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.request_id = uuid.uuid4().hex[:12]
+        self.spans = {}
+        self.tokens = {}
+        self.errors = {}
+        self.attributes = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage):
+        """Time a stage of this request and record it in the stage histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as exc:
+            self.record_error(stage, exc)
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+        registry.histogram(
+            "stayeasy_stage_seconds", stage, "Time spent in each request stage"
+        ).observe(seconds)
+
+    def record_error(self, stage, exc):
+        """Note that a stage failed; the trace keeps the first error per stage."""
+        self.errors.setdefault(stage, type(exc).__name__)
+        registry.inc("stayeasy_stage_errors_total", stage, 1, "Errors raised in each request stage", label_name="stage")
+
+    def record_usage(self, usage):
+        """Add prompt/completion token counts from an OpenAI usage object (may be None)."""
+        if usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            count = getattr(usage, kind, 0) or 0
+            self.tokens[kind] = self.tokens.get(kind, 0) + count
+            registry.inc("stayeasy_llm_tokens_total", kind, count, "OpenAI tokens used")
+
+    def finish(self, **attributes):
+        """Record the end-to-end time and log the trace as one JSON line."""
+        total = time.perf_counter() - self._start
+        self.attributes.update(attributes)
+        registry.histogram(
+            "stayeasy_request_seconds", self.name, "End-to-end request time", label_name="endpoint"
+        ).observe(total)
+        registry.inc("stayeasy_requests_total", self.name, 1, "Requests handled", label_name="endpoint")
+        if TRACE_LOG:
+            logger.info(json.dumps({
+                "event": self.name,
+                "request_id": self.request_id,
+                "total_ms": round(total * 1000, 2),
+                "spans_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.spans.items()},
+                "tokens": self.tokens,
+                **({"errors": self.errors} if self.errors else {}),
+                **self.attributes,
+            }))
+        for listener in trace_listeners:
+            listener(self, total)
+        return total
+
+
+@contextmanager
+def span(trace, stage):
+    """trace.span(stage) that also works when no trace is being collected."""
+    if trace is None:
+        yield
+    else:
+        with trace.span(stage):
+            yield
+
+
+# ============================================================
+# METRICS ENDPOINT
+# ============================================================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics from a background thread; returns the server (or None if disabled)."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available at http://localhost:{port}/metrics")
+    return server
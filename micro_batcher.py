@@ -0,0 +1,251 @@
+"""
+micro_batcher.py - Batch concurrent query embeddings into one forward pass
+
+When many chats retrieve at the same time, each one used to run the encoder
+on its own question (batch size 1), taking turns on model_lock. MicroBatcher
+sits in front of the query encoder: calls that arrive within a few
+milliseconds of each other are collected, up to a maximum batch, encoded
+with a single encode() call on a background thread, and every caller gets
+its own rows back.
+
+It has the same encode() signature as the model, so it can be passed to
+embedding_cache.encode_query() in place of the model. Only cache misses
+reach it.
+
+Batch sizes, time spent waiting for a batch and time spent encoding are
+exported as stayeasy_embed_batch_size / stayeasy_embed_batch_wait_seconds /
+stayeasy_embed_batch_seconds on /metrics (see metrics.py).
+
+Run (compare concurrent encoding with and without batching):
+    python micro_batcher.py
+    python micro_batcher.py --threads 32 --window-ms 5
+
+Settings (environment variables):
+    MICRO_BATCH             "1" (default) to batch query embeddings in app.py, "0" to call the model directly
+    MICRO_BATCH_MAX         most questions encoded in one call (default 32)
+    MICRO_BATCH_WINDOW_MS   how long the first question waits for others to join (default 2)
+"""
+
+import os
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from embedding_cache import encoder_variant, model_lock
+from metrics import registry
+from config import EMBEDDING_MODEL
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+MICRO_BATCH = os.getenv("MICRO_BATCH", "1") != "0"
+MAX_BATCH = int(os.getenv("MICRO_BATCH_MAX", "32"))
+WINDOW_MS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "2"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+# ============================================================
+# MICRO BATCHER
+# ============================================================
+
+class _Request:
+    __slots__ = ("texts", "future", "queued_at")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Collects encode() calls from many threads and runs them through encode_fn in batches.
+
+    encode_fn takes a list of strings and returns one row per string. It is
+    only ever called from the batcher's own thread, under model_lock, so the
+    model is never used concurrently.
+    """
+
+    # embedding_cache does not take model_lock around our encode(): holding it
+    # while waiting for a batch would stop any other caller from joining one
+    locks_model = True
+
+    def __init__(self, encode_fn, max_batch=MAX_BATCH, window_ms=WINDOW_MS, name="query", variant="torch"):
+        self.encode_fn = encode_fn
+        self.variant = variant  # the wrapped encoder's, for the query cache key
+        self.max_batch = max(1, max_batch)
+        self.window = max(0.0, window_ms) / 1000
+        self.name = name
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._carry = None  # request that did not fit in the previous batch
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"micro-batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        """Queue a list of strings; returns a Future for their embeddings (one row each)."""
+        request = _Request(list(texts))
+        self._queue.put(request)
+        return request.future
+
+    def encode(self, sentences, **kwargs):
+        """model.encode() look-alike: a string gives one vector, a list gives one row per string."""
+        if isinstance(sentences, str):
+            return self.submit([sentences]).result()[0]
+        return self.submit(sentences).result()
+
+    def _next_batch(self):
+        first = self._carry or self._queue.get()
+        self._carry = None
+        if first is None:
+            return None
+        batch, size = [first], len(first.texts)
+        deadline = time.perf_counter() + self.window
+        while size < self.max_batch:
+            try:
+                remaining = deadline - time.perf_counter()
+                # Past the window, still take whatever is already queued
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # close() after this batch
+                break
+            if size + len(request.texts) > self.max_batch:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # Callers cannot cancel a request once its batch has started
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for request in batch for text in request.texts]
+            # Nothing may escape this loop: if the thread died, every encode() caller would wait forever
+            try:
+                started = time.perf_counter()
+                with model_lock:
+                    embeddings = np.asarray(self.encode_fn(texts))
+                finished = time.perf_counter()
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"encoder returned {len(embeddings)} rows for {len(texts)} texts")
+
+                offset = 0
+                for request in batch:
+                    n = len(request.texts)
+                    # Copies, so one caller's rows do not keep the whole batch alive
+                    request.future.set_result(embeddings[offset:offset + n].copy())
+                    offset += n
+            except Exception as exc:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(exc)
+                continue
+            try:
+                self._record(batch, len(texts), started, finished)
+            except Exception as exc:
+                print(f"Could not record micro-batch metrics: {type(exc).__name__}: {exc}")
+
+    def _record(self, batch, n_texts, started, finished):
+        registry.histogram(
+            "stayeasy_embed_batch_size", self.name, "Questions encoded per model call",
+            label_name="encoder", buckets=BATCH_SIZE_BUCKETS,
+        ).observe(n_texts)
+        registry.histogram(
+            "stayeasy_embed_batch_seconds", self.name, "Time per batched model call", label_name="encoder",
+        ).observe(finished - started)
+        wait = registry.histogram(
+            "stayeasy_embed_batch_wait_seconds", self.name, "Time a question waited for its batch to start",
+            label_name="encoder",
+        )
+        for request in batch:
+            wait.observe(started - request.queued_at)
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.texts += n_texts
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+            }
+
+    def close(self):
+        """Finish the queued work and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def batched_encoder(encoder, enabled=MICRO_BATCH, max_batch=MAX_BATCH, window_ms=WINDOW_MS):
+    """Put a MicroBatcher in front of encoder (anything with encode(list)), or return it unchanged."""
+    if not enabled:
+        return encoder
+    print(f"Batching query embeddings (up to {max_batch} per call, {window_ms:g} ms window)")
+    return MicroBatcher(encoder.encode, max_batch=max_batch, window_ms=window_ms, variant=encoder_variant(encoder))
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def _throughput(encoder, questions, threads):
+    """Questions per second when `threads` callers encode one question at a time."""
+    def encode_one(question):
+        if getattr(encoder, "locks_model", False):
+            return encoder.encode(question)
+        with model_lock:
+            return encoder.encode(question)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(encode_one, questions))
+        return len(questions) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare concurrent query encoding with and without micro-batching")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent callers")
+    parser.add_argument("--questions", type=int, default=512, help="questions to encode")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--window-ms", type=float, default=WINDOW_MS)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    print("=" * 50)
+    print("StayEasy RAG - Query Micro-Batching")
+    print("=" * 50)
+
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    questions = [f"What is the cancellation policy for booking number {i}?" for i in range(args.questions)]
+    model.encode(questions[:8])  # warm-up
+
+    direct = _throughput(model, questions, args.threads)
+    batcher = MicroBatcher(model.encode, max_batch=args.max_batch, window_ms=args.window_ms)
+    batched = _throughput(batcher, questions, args.threads)
+    batcher.close()
+
+    print(f"\n  {args.threads} threads, {args.questions} questions")
+    print(f"  direct:   {direct:8.1f} questions/sec")
+    print(f"  batched:  {batched:8.1f} questions/sec  "
+          f"(avg batch {batcher.stats()['avg_batch_size']:.1f}, {args.window_ms:g} ms window)")
+
+
+if __name__ == "__main__":
+    main()
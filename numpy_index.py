@@ -0,0 +1,369 @@
+"""
+numpy_index.py - In-memory brute-force vector search with NumPy
+
+For a corpus this size, an exact search over one matrix is faster than going
+through ChromaDB: every chunk embedding is loaded once into a normalized
+float32 matrix, and a query is a single matrix-vector product plus
+argpartition (a batch of queries is one matrix-matrix product).
+
+NumpyIndex answers query()/count()/get() with the same result layout as a
+Chroma collection, so retrieve() works unchanged on either backend.
+
+Compact index
+-------------
+`python ingest.py --export-index int8 [--pca 128]` writes chroma_db/numpy_index/
+with the vectors stored as float16 or scalar-quantized int8 (optionally after
+a PCA projection fitted on the corpus). Only the compact matrix is kept in
+RAM. Search scores against it, takes RESCORE_FACTOR x top_k candidates, and
+re-scores those with the full-precision vectors, which are memory-mapped from
+disk and never fully loaded. `python evaluate.py --backend compact` checks
+that recall@5 stays within tolerance of exact search.
+
+Everything in the export is opened read-only and memory-mapped: the vectors
+(.npy) and the records (records.jsonl, one JSON line per chunk, found by byte
+offset; IDs are looked up by binary search in a sorted array). Worker
+processes that load the same export (`python api.py --workers 4`) share
+those pages through the OS page cache instead of each holding a copy, and
+`--export-index float32` gives a shared index that is still searched exactly.
+
+Settings (environment variables):
+    RETRIEVAL_BACKEND   "chroma" (default), "numpy" or "compact"
+    RESCORE_FACTOR      candidates re-scored per result for the compact index (default 4)
+"""
+
+import os
+import json
+import mmap
+import numpy as np
+from bm25_index import HybridIndex, load_bm25_index, index_space, HYBRID_SEARCH
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+INDEX_DIR = os.path.join("chroma_db", "numpy_index")
+LOAD_PAGE_SIZE = 1000     # records fetched from Chroma per request when loading
+SCORE_BLOCK_ROWS = 16384  # compact rows widened to float32 at a time while scoring
+EMBEDDING_DIM = 384       # all-MiniLM-L6-v2; only used to shape the matrix of an empty collection
+
+
+# ============================================================
+# INDEX
+# ============================================================
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class MappedRecords:
+    """IDs, text and metadata of a saved index, read from memory-mapped files on demand."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "records.jsonl"), "rb") as f:
+            # mmap cannot map an empty file
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._offsets = np.load(os.path.join(path, "record_offsets.npy"), mmap_mode="r")
+        self._sorted_ids = np.load(os.path.join(path, "ids_sorted.npy"), mmap_mode="r")
+        self._id_order = np.load(os.path.join(path, "ids_order.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def record(self, position):
+        """{"id", "document", "metadata"} of the chunk at a position."""
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return json.loads(self._data[start:end])
+
+    def get(self, chunk_id):
+        """Position of a chunk ID, or None (same as dict.get on an ID -> position map)."""
+        i = int(np.searchsorted(self._sorted_ids, chunk_id))
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == chunk_id:
+            return int(self._id_order[i])
+        return None
+
+    @staticmethod
+    def save(path, ids, documents, metadatas):
+        offsets = [0]
+        with open(os.path.join(path, "records.jsonl"), "wb") as f:
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                line = json.dumps({"id": chunk_id, "document": document, "metadata": metadata}).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(path, "record_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        id_array = np.asarray(ids, dtype=str)
+        order = np.argsort(id_array, kind="stable")
+        np.save(os.path.join(path, "ids_sorted.npy"), id_array[order])
+        np.save(os.path.join(path, "ids_order.npy"), order.astype(np.int64))
+
+
+class _RecordField:
+    """One field of MappedRecords as a read-only sequence, so index.ids[p] etc. work unchanged."""
+
+    def __init__(self, records, field):
+        self.records = records
+        self.field = field
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, position):
+        return self.records.record(position)[self.field]
+
+
+class NumpyIndex:
+    """Top-k search over a normalized (n_chunks, dim) matrix.
+
+    By default the search matrix is the full float32 embeddings and search is
+    exact. A compact index searches a float16/int8 (optionally PCA-reduced)
+    matrix instead and re-scores the best candidates against `full`.
+    """
+
+    def __init__(self, ids, embeddings, documents, metadatas, metadata=None):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+        self.metadata = dict(metadata or {})
+        embeddings = np.asarray(embeddings if embeddings is not None else [], dtype=np.float32)
+        if embeddings.size == 0:
+            # An empty collection has no rows to take the width from
+            embeddings = embeddings.reshape(0, embeddings.shape[-1] if embeddings.ndim == 2 else EMBEDDING_DIM)
+        self.embeddings = _normalize_rows(embeddings)
+        self.space = index_space(self.metadata)
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+
+        # Search matrix and how to map a query into its space (identity by default)
+        self.vectors = self.embeddings
+        self.scale = None           # per-dimension int8 scale
+        self.pca_mean = None
+        self.pca_components = None  # (dim, reduced_dim)
+        self.rescore_factor = RESCORE_FACTOR
+
+    @classmethod
+    def from_collection(cls, collection, page_size=LOAD_PAGE_SIZE):
+        """Copy every record of a Chroma collection into memory."""
+        ids, embeddings, documents, metadatas = [], [], [], []
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=page_size,
+                offset=offset,
+            )
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            embeddings.extend(page["embeddings"])
+            documents.extend(page["documents"])
+            metadatas.extend(page["metadatas"])
+            offset += len(page["ids"])
+        return cls(ids, embeddings, documents, metadatas, metadata=collection.metadata)
+
+    @property
+    def is_exact(self):
+        return self.vectors is self.embeddings
+
+    def count(self):
+        return len(self.ids)
+
+    def memory_bytes(self):
+        """Bytes of the matrix that has to stay resident for search."""
+        return self.vectors.nbytes
+
+    def _distances(self, similarities):
+        """Turn cosine similarities into the distance Chroma would report for this space."""
+        if self.space == "l2":
+            # Squared L2 between unit vectors
+            return 2.0 - 2.0 * similarities
+        return 1.0 - similarities
+
+    def _approximate_scores(self, queries):
+        """Scores of every row of the search matrix, widening it to float32 block by block."""
+        if self.pca_components is not None:
+            queries = (queries - self.pca_mean) @ self.pca_components
+        if self.scale is not None:
+            # (q * scale) . codes == q . (codes * scale)
+            queries = queries * self.scale
+        if self.vectors.dtype == np.float32:
+            return queries @ self.vectors.T
+        scores = np.empty((len(queries), len(self.vectors)), dtype=np.float32)
+        for start in range(0, len(self.vectors), SCORE_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        return scores
+
+    @staticmethod
+    def _top(scores, k):
+        """Column indices and values of the k largest scores per row, best first."""
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query_embeddings, n_results):
+        """Return (positions, similarities), each (n_queries, k), best match first."""
+        queries = _normalize_rows(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        k = min(n_results, len(self.ids))
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty
+        if self.is_exact:
+            return self._top(queries @ self.embeddings.T, k)
+
+        # Compact index: shortlist with approximate scores, then re-score exactly
+        n_candidates = min(len(self.ids), k * max(1, self.rescore_factor))
+        candidates, _ = self._top(self._approximate_scores(queries), n_candidates)
+        exact = np.empty(candidates.shape, dtype=np.float32)
+        for row, query in enumerate(queries):
+            rows = np.sort(candidates[row])  # sorted reads are kinder to the memory map
+            exact_row = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+            candidates[row] = rows
+            exact[row] = exact_row
+        best, best_scores = self._top(exact, k)
+        return np.take_along_axis(candidates, best, axis=1), best_scores
+
+    def query(self, query_embeddings, n_results=10, **kwargs):
+        """Same result layout as Collection.query: one list per query embedding."""
+        positions, similarities = self.search(query_embeddings, n_results)
+        distances = self._distances(similarities)
+        return {
+            "ids": [[self.ids[p] for p in row] for row in positions],
+            "documents": [[self.documents[p] for p in row] for row in positions],
+            "metadatas": [[self.metadatas[p] for p in row] for row in positions],
+            "distances": [row.tolist() for row in distances],
+        }
+
+    def get(self, ids, include=("documents", "metadatas"), **kwargs):
+        """Look up records by ID (same layout as Collection.get)."""
+        positions = [p for p in (self._positions.get(chunk_id) for chunk_id in ids) if p is not None]
+        result = {"ids": [self.ids[p] for p in positions]}
+        if "documents" in include:
+            result["documents"] = [self.documents[p] for p in positions]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[p] for p in positions]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(self.embeddings[positions], dtype=np.float32)
+        return result
+
+    # ------------------------------------------------------------
+    # Compact format on disk
+    # ------------------------------------------------------------
+
+    def compact(self, dtype="int8", pca_dim=None):
+        """Build the compact search matrix (float16 or int8, optionally PCA-reduced) in place."""
+        vectors = self.embeddings
+        if pca_dim and pca_dim < vectors.shape[1] and len(vectors):
+            self.pca_mean = vectors.mean(axis=0)
+            centered = vectors - self.pca_mean
+            eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+            # eigh sorts ascending; keep the directions with the most variance
+            self.pca_components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :pca_dim], dtype=np.float32)
+            vectors = centered @ self.pca_components
+
+        if dtype == "float16":
+            self.vectors = vectors.astype(np.float16)
+        elif dtype == "int8":
+            self.scale = np.maximum(np.abs(vectors).max(axis=0, initial=0.0), 1e-12).astype(np.float32) / 127.0
+            self.vectors = np.clip(np.round(vectors / self.scale), -127, 127).astype(np.int8)
+        elif dtype == "float32":
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            if self.pca_components is None:
+                self.vectors = self.embeddings
+        else:
+            raise ValueError(f"Unknown index dtype {dtype!r} (expected float32, float16 or int8)")
+        return self
+
+    def save(self, path=INDEX_DIR):
+        """Write the index as .npy arrays plus memory-mappable records (see MappedRecords)."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "full.npy"), self.embeddings)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        extras = {}
+        if self.scale is not None:
+            extras["scale"] = self.scale
+        if self.pca_components is not None:
+            extras["pca_mean"] = self.pca_mean
+            extras["pca_components"] = self.pca_components
+        np.savez(os.path.join(path, "transform.npz"), **extras)
+        MappedRecords.save(path, self.ids, self.documents, self.metadatas)
+        # Written last: load_backend() treats its presence as "export complete"
+        with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"metadata": self.metadata}, f)
+
+    @classmethod
+    def load(cls, path=INDEX_DIR):
+        """Open a saved index read-only; vectors and records stay memory-mapped on disk."""
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            index_info = json.load(f)
+        records = MappedRecords(path)
+        index = cls.__new__(cls)
+        index.ids = _RecordField(records, "id")
+        index.documents = _RecordField(records, "document")
+        index.metadatas = _RecordField(records, "metadata")
+        index.metadata = index_info["metadata"]
+        index.space = index_space(index.metadata)
+        index._positions = records
+        index.rescore_factor = RESCORE_FACTOR
+
+        index.embeddings = np.load(os.path.join(path, "full.npy"), mmap_mode="r")
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        transform = np.load(os.path.join(path, "transform.npz"))
+        index.scale = transform["scale"] if "scale" in transform else None
+        index.pca_mean = transform["pca_mean"] if "pca_mean" in transform else None
+        index.pca_components = transform["pca_components"] if "pca_components" in transform else None
+        if vectors.dtype == np.float32 and index.pca_components is None:
+            # Uncompressed export: search the full matrix directly (exact)
+            index.embeddings = vectors
+        index.vectors = vectors
+        return index
+
+
+def export_index(collection, dtype="int8", pca_dim=None, path=INDEX_DIR):
+    """Write a compact copy of the collection for RETRIEVAL_BACKEND=compact."""
+    index = NumpyIndex.from_collection(collection).compact(dtype, pca_dim)
+    index.save(path)
+    full_mb = index.embeddings.nbytes / 1e6
+    print(f"Exported {index.count()} vectors to {path}/ as {dtype}"
+          f"{f' with PCA to {pca_dim} dims' if index.pca_components is not None else ''}: "
+          f"{index.memory_bytes() / 1e6:.2f} MB resident vs {full_mb:.2f} MB float32")
+    return index
+
+
+def load_backend(collection, backend=RETRIEVAL_BACKEND, hybrid=HYBRID_SEARCH):
+    """Return what retrieve() should query.
+
+    The dense side is the Chroma collection itself, a NumpyIndex over it, or
+    the compact index exported by ingest.py; with hybrid=True it is wrapped
+    so BM25 keyword matches are fused in. The compact index can be opened
+    without a collection (collection=None), e.g. by API workers that should
+    not each open ChromaDB.
+    """
+    index_version = (collection.metadata or {}).get("index_version", "") if collection is not None else None
+    if backend == "chroma":
+        dense = collection
+    elif backend == "numpy":
+        print("Loading embeddings into the in-memory NumPy index...")
+        dense = NumpyIndex.from_collection(collection)
+    elif backend == "compact":
+        if not os.path.exists(os.path.join(INDEX_DIR, "index.json")):
+            raise FileNotFoundError(f"No compact index in {INDEX_DIR}/ (run: python ingest.py --export-index int8)")
+        print(f"Loading compact index from {INDEX_DIR}/...")
+        dense = NumpyIndex.load(INDEX_DIR)
+        if index_version is None:
+            index_version = dense.metadata.get("index_version", "")
+        elif dense.metadata.get("index_version", "") != index_version:
+            print("Warning: compact index is older than the collection (re-run ingest.py --export-index)")
+    else:
+        raise ValueError(f"Unknown RETRIEVAL_BACKEND {backend!r} (expected 'chroma', 'numpy' or 'compact')")
+
+    bm25 = None
+    if hybrid:
+        bm25 = load_bm25_index(index_version)
+    return HybridIndex(dense, bm25)
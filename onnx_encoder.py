@@ -0,0 +1,258 @@
+"""
+onnx_encoder.py - ONNX Runtime backend for query embeddings
+
+Every retrieve() call embeds the question, and on CPU the PyTorch forward
+pass of all-MiniLM-L6-v2 is most of the time spent outside the LLM. This
+exports the transformer once to onnx_model/ (optionally with int8 dynamic
+quantization) and encodes queries with ONNX Runtime instead, using the same
+tokenizer, mean pooling and normalization as SentenceTransformer.
+
+At load time the ONNX embeddings are compared with the PyTorch ones on a few
+sample questions; if the lowest cosine similarity is below ONNX_PARITY_MIN
+the app falls back to PyTorch and says so.
+
+Documents are still embedded with PyTorch in ingest.py.
+
+Run (export, parity check and a latency comparison):
+    python onnx_encoder.py
+    python onnx_encoder.py --int8
+
+Settings (environment variables):
+    QUERY_ENCODER     "torch" (default), "onnx" or "onnx-int8"
+    ONNX_DIR          where the exported model lives (default onnx_model)
+    ONNX_PARITY_MIN   lowest acceptable cosine similarity to PyTorch (default 0.98)
+    ONNX_THREADS      intra-op threads for ONNX Runtime (default 0 = all cores)
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from config import EMBEDDING_MODEL
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+QUERY_ENCODER = os.getenv("QUERY_ENCODER", "torch")
+ONNX_DIR = os.getenv("ONNX_DIR", "onnx_model")
+PARITY_MIN = float(os.getenv("ONNX_PARITY_MIN", "0.98"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+MODEL_FILES = {False: "model.onnx", True: "model_int8.onnx"}
+CONFIG_FILE = "encoder_config.json"
+OPSET = 14
+
+# Questions shaped like real support traffic, used for the parity check
+PARITY_SENTENCES = [
+    "What is the guest service fee?",
+    "When do hosts receive their payout?",
+    "What is the emergency phone number?",
+    "How many photos are required for a listing?",
+    "What is the cancellation policy for flexible bookings?",
+    "Superhost requirements: 10+ completed bookings, 90%+ response rate and a 4.8+ star rating",
+]
+
+
+# ============================================================
+# EXPORT
+# ============================================================
+
+def export_onnx(model, path=ONNX_DIR, quantize=False, model_name=EMBEDDING_MODEL):
+    """Export a SentenceTransformer's transformer to ONNX, plus its tokenizer and pooling settings."""
+    import torch
+
+    modules = list(model)
+    pooling = next((m for m in modules if type(m).__name__ == "Pooling"), None)
+    if pooling is None or pooling.get_pooling_mode_str() != "mean":
+        raise ValueError("Only mean-pooling SentenceTransformer models can be exported")
+
+    os.makedirs(path, exist_ok=True)
+    tokenizer = model.tokenizer
+    tokenizer.save_pretrained(path)  # writes tokenizer.json for fast tokenizers
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.transformer(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            ).last_hidden_state
+
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    sample = tokenizer(["export sample"], return_tensors="pt", return_token_type_ids=True)
+    fp32_path = os.path.join(path, MODEL_FILES[False])
+    print(f"Exporting {model_name} to {fp32_path}...")
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(modules[0].auto_model).eval(),
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+            opset_version=OPSET,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(path, MODEL_FILES[True])
+        print(f"Quantizing weights to int8: {int8_path}")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    with open(os.path.join(path, CONFIG_FILE), "w") as f:
+        json.dump({
+            "model": model_name,
+            "max_seq_length": model.max_seq_length,
+            "pad_token": tokenizer.pad_token,
+            "pad_id": tokenizer.pad_token_id,
+            "normalize": any(type(m).__name__ == "Normalize" for m in modules),
+        }, f, indent=2)
+
+
+def exported_model_name(path=ONNX_DIR):
+    """Name of the model exported to path, or None if nothing is there."""
+    try:
+        with open(os.path.join(path, CONFIG_FILE)) as f:
+            return json.load(f)["model"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# ============================================================
+# ENCODER
+# ============================================================
+
+class OnnxEncoder:
+    """Drop-in for SentenceTransformer.encode() on the query path, backed by ONNX Runtime."""
+
+    def __init__(self, path=ONNX_DIR, quantized=False, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.quantized = quantized
+        self.variant = "onnx-int8" if quantized else "onnx"  # keeps its query cache entries apart
+        self.normalize = self.config["normalize"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(path, MODEL_FILES[quantized]), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """Embed a string (returns a 1-D array) or a list of strings (returns a 2-D array)."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(sentences[start:start + batch_size])
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": attention_mask,
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+            # Mean pooling over real tokens, as in sentence_transformers.models.Pooling
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled.astype(np.float32))
+        embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def check_parity(encoder, model, sentences=PARITY_SENTENCES):
+    """Lowest cosine similarity between ONNX and PyTorch embeddings of the same sentences."""
+    reference = model.encode(sentences, normalize_embeddings=True)
+    candidate = encoder.encode(sentences)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return float(np.min(np.sum(reference * candidate, axis=1)))
+
+
+def load_query_encoder(model, backend=QUERY_ENCODER, path=ONNX_DIR, min_similarity=PARITY_MIN,
+                       model_name=EMBEDDING_MODEL):
+    """Return the object retrieve() should embed questions with.
+
+    "torch" returns model unchanged. "onnx" / "onnx-int8" export the model on
+    first use, then return an OnnxEncoder if it passes the parity check
+    against model (and model otherwise).
+    """
+    if backend == "torch":
+        return model
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"Unknown QUERY_ENCODER {backend!r} (expected 'torch', 'onnx' or 'onnx-int8')")
+
+    quantized = backend == "onnx-int8"
+    if exported_model_name(path) != model_name or not os.path.exists(os.path.join(path, MODEL_FILES[quantized])):
+        export_onnx(model, path, quantize=quantized, model_name=model_name)
+
+    encoder = OnnxEncoder(path, quantized)
+    similarity = check_parity(encoder, model)
+    if similarity < min_similarity:
+        print(f"Warning: ONNX query encoder differs from PyTorch (cosine {similarity:.4f} < {min_similarity}), "
+              f"using PyTorch")
+        return model
+    print(f"Query encoder: ONNX Runtime {'int8' if quantized else 'fp32'} (parity cosine {similarity:.4f})")
+    return encoder
+
+
+# ============================================================
+# MAIN: EXPORT AND COMPARE
+# ============================================================
+
+def _median_ms(encoder, sentences, rounds=20):
+    timings = []
+    for _ in range(rounds):
+        for sentence in sentences:
+            start = time.perf_counter()
+            encoder.encode(sentence)
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the query encoder to ONNX and compare it with PyTorch")
+    parser.add_argument("--int8", action="store_true", help="also quantize the weights to int8")
+    parser.add_argument("--output", default=ONNX_DIR, help="directory for the exported model")
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    print("=" * 50)
+    print("StayEasy RAG - ONNX Query Encoder")
+    print("=" * 50)
+
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    export_onnx(model, args.output, quantize=args.int8)
+
+    encoders = {"torch": model, "onnx": OnnxEncoder(args.output)}
+    if args.int8:
+        encoders["onnx-int8"] = OnnxEncoder(args.output, quantized=True)
+
+    print(f"\n  {'backend':<10} {'parity':>8} {'median ms/query':>16}")
+    for name, encoder in encoders.items():
+        parity = 1.0 if encoder is model else check_parity(encoder, model)
+        encoder.encode(PARITY_SENTENCES[0])  # warm-up
+        print(f"  {name:<10} {parity:>8.4f} {_median_ms(encoder, PARITY_SENTENCES):>16.2f}")
+    print(f"\nUse it with: QUERY_ENCODER={'onnx-int8' if args.int8 else 'onnx'} python app.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+source_text.py - Read chunk text straight from the source documents
+
+ingest.py records where every chunk came from: the file name, its byte
+offsets in that file and its line range. With STORE_DOCUMENTS=0 the chunk
+text is not copied into ChromaDB at all (smaller database, less data sent
+back per query), and retrieval slices it out of the memory-mapped markdown
+files here instead.
+
+A slice is checked against the chunk's content_hash, so a document edited
+after the last ingest is noticed instead of returning the wrong text.
+
+Settings (environment variables):
+    STORE_DOCUMENTS   "1" (default) to also store chunk text in ChromaDB, "0" to read it from data/
+"""
+
+import os
+import mmap
+import hashlib
+import threading
+from config import EMBEDDING_MODEL
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+DATA_FOLDER = "data"
+STORE_DOCUMENTS = os.getenv("STORE_DOCUMENTS", "1") != "0"
+
+
+def fingerprint(model_name, heading, text):
+    """Hash everything that affects a chunk's stored embedding and metadata."""
+    digest = hashlib.sha256()
+    for part in (model_name, heading, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# ============================================================
+# SOURCE READER
+# ============================================================
+
+class SourceReader:
+    """Memory-maps each source file once and slices chunk text out of it by byte offsets."""
+
+    def __init__(self, folder=DATA_FOLDER, model_name=EMBEDDING_MODEL):
+        self.folder = folder
+        self.model_name = model_name
+        self._maps = {}
+        self._warned = set()
+        self._lock = threading.Lock()
+
+    def _map(self, filename, reopen=False):
+        with self._lock:
+            mapped = self._maps.get(filename)
+            if mapped is None or reopen:
+                with open(os.path.join(self.folder, filename), "rb") as f:
+                    # mmap cannot map an empty file
+                    size = os.fstat(f.fileno()).st_size
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+                self._maps[filename] = mapped
+            return mapped
+
+    def read(self, filename, start, end, reopen=False):
+        """Text of bytes [start, end) of a source file."""
+        return self._map(filename, reopen)[start:end].decode("utf-8", errors="replace")
+
+    def read_chunk(self, metadata):
+        """Chunk text for a stored metadata dict, or "" if the source has changed since ingest."""
+        filename = metadata["filename"]
+        try:
+            for reopen in (False, True):
+                # The file may have been rewritten since it was mapped, so retry once on a fresh map
+                text = self.read(filename, metadata["source_start"], metadata["source_end"], reopen)
+                if fingerprint(self.model_name, metadata.get("heading", ""), text) == metadata.get("content_hash"):
+                    return text
+        except OSError:
+            pass
+        if filename not in self._warned:
+            self._warned.add(filename)
+            print(f"Warning: {filename} changed since it was ingested (re-run ingest.py)")
+        return ""
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                if isinstance(mapped, mmap.mmap):
+                    mapped.close()
+            self._maps.clear()
+
+
+# One reader per process, shared by answer.py, app.py and evaluate.py
+source_reader = SourceReader()
+
+
+def chunk_text(document, metadata):
+    """The chunk's text: the stored document if ChromaDB has it, else sliced from the source file."""
+    if document is not None:
+        return document
+    if "source_start" not in metadata:
+        return ""
+    return source_reader.read_chunk(metadata)
@@ -0,0 +1,195 @@
+"""
+sweep_index.py - Recall and latency of the HNSW index under several profiles
+
+Builds a scratch Chroma collection for each index profile (see
+INDEX_PROFILES in ingest.py, or "key=value" specs like "M=32,search_ef=100")
+from the same embeddings, then measures:
+  - build time (construction_ef and M make the index slower to build)
+  - single-query latency p50 / p95 / p99
+  - recall@k against exact brute-force search over the same vectors
+
+The embeddings come from chroma_db/ (run ingest.py first), so nothing is
+re-embedded; --synthetic-docs N embeds a generated corpus instead (see
+benchmark.py) when the real one is too small for the profiles to differ.
+MiniLM embeddings are normalized, so exact search ranks the same in every
+space.
+
+Apply the chosen profile with: python ingest.py --index-profile <profile>
+
+Run:
+    python sweep_index.py
+    python sweep_index.py --profiles "fast;balanced;M=48,search_ef=300" --k 10
+    python sweep_index.py --synthetic-docs 2000 --output sweep_results.json
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import chromadb
+import ingest
+from benchmark import _fact, generate_corpus, git_commit, percentile
+from numpy_index import NumpyIndex
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+DEFAULT_PROFILES = list(ingest.INDEX_PROFILES)
+TOP_K = 5
+N_QUERIES = 200
+MIN_RECALL = 0.95   # the fastest profile at or above this is suggested
+OUTPUT_PATH = "sweep_results.json"
+
+
+# ============================================================
+# VECTORS AND QUERIES
+# ============================================================
+
+def _queries(rng, headings, n_queries):
+    """Questions shaped like benchmark.py's: a section heading plus a fee / timeframe / phone number."""
+    sampled = [rng.choice(headings) for _ in range(n_queries)]
+    return [f"{heading.split(' > ')[-1]} {_fact(rng)}?" for heading in sampled]
+
+
+def load_collection_vectors(embedding_model, n_queries, seed=1):
+    """Embeddings already stored in chroma_db/, plus questions about their sections."""
+    client = chromadb.PersistentClient(path=ingest.CHROMA_PATH)
+    index = NumpyIndex.from_collection(client.get_collection(ingest.COLLECTION_NAME))
+    headings = [metadata.get("heading") or metadata["filename"] for metadata in index.metadatas]
+    questions = _queries(random.Random(seed), headings, n_queries)
+    return index, embedding_model.encode(questions, batch_size=ingest.EMBED_BATCH_SIZE)
+
+
+def embed_synthetic_corpus(embedding_model, n_docs, n_queries, seed=1):
+    """Generate, chunk and embed a synthetic corpus of n_docs documents."""
+    with tempfile.TemporaryDirectory(prefix="stayeasy-sweep-") as work_dir:
+        generate_corpus(work_dir, n_docs)
+        chunks = ingest.chunk_documents(ingest.load_documents(work_dir))
+    print(f"Embedding {len(chunks)} synthetic chunks...")
+    embeddings = ingest.embed_texts(embedding_model, [chunk["text"] for chunk in chunks])
+    ids = [f"{chunk['filename']}_{chunk['chunk_id']}" for chunk in chunks]
+    metadatas = [{"heading": chunk["heading"]} for chunk in chunks]
+    index = NumpyIndex(ids, embeddings, [None] * len(ids), metadatas)
+    questions = _queries(random.Random(seed), [chunk["heading"] for chunk in chunks], n_queries)
+    return index, embedding_model.encode(questions, batch_size=ingest.EMBED_BATCH_SIZE)
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+
+def measure_profile(spec, index, queries, exact_ids, k, work_dir):
+    """Build a scratch collection with one profile and measure it against exact search."""
+    settings = ingest.parse_index_profile(spec)
+    # A separate client path per profile: Chroma shares one system per path in a process
+    client = chromadb.PersistentClient(path=os.path.join(work_dir, f"profile_{len(os.listdir(work_dir))}"))
+    collection = client.create_collection(name="sweep", metadata=ingest.profile_metadata(spec))
+
+    embeddings = index.embeddings.tolist()
+    start = time.perf_counter()
+    for batch in ingest.iter_batches(range(index.count()), ingest.max_chroma_batch_size(client)):
+        collection.add(ids=[index.ids[i] for i in batch], embeddings=[embeddings[i] for i in batch])
+    build_seconds = time.perf_counter() - start
+
+    query_rows = queries.tolist()
+    collection.query(query_embeddings=[query_rows[0]], n_results=k, include=[])  # warm-up
+    latencies, hits = [], 0
+    for row, expected in zip(query_rows, exact_ids):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[row], n_results=k, include=[])
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(expected & set(result["ids"][0]))
+
+    return {
+        "profile": spec,
+        "settings": settings,
+        f"recall_at_{k}": round(hits / sum(len(expected) for expected in exact_ids), 4),
+        "query_ms": {
+            "queries": len(latencies),
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+        },
+        "build_seconds": round(build_seconds, 3),
+    }
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure HNSW recall and latency under several index profiles")
+    parser.add_argument("--profiles", default=";".join(DEFAULT_PROFILES),
+                        help="semicolon-separated profile names or key=value specs")
+    parser.add_argument("--k", type=int, default=TOP_K, help="results per query (recall@k)")
+    parser.add_argument("--queries", type=int, default=N_QUERIES, help="questions to run per profile")
+    parser.add_argument("--synthetic-docs", type=int, default=0,
+                        help="embed a synthetic corpus of this many documents instead of using chroma_db/")
+    parser.add_argument("--min-recall", type=float, default=MIN_RECALL,
+                        help="recall the suggested profile must reach")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="where to write the JSON results")
+    args = parser.parse_args()
+
+    profiles = [spec.strip() for spec in args.profiles.split(";") if spec.strip()]
+    for spec in profiles:
+        try:
+            ingest.parse_index_profile(spec)
+        except ValueError as exc:
+            parser.error(str(exc))
+
+    from sentence_transformers import SentenceTransformer
+
+    print("=" * 60)
+    print("  StayEasy RAG - Index Profile Sweep")
+    print("=" * 60)
+
+    embedding_model = SentenceTransformer(ingest.EMBEDDING_MODEL)
+    if args.synthetic_docs:
+        index, queries = embed_synthetic_corpus(embedding_model, args.synthetic_docs, args.queries)
+    else:
+        index, queries = load_collection_vectors(embedding_model, args.queries)
+    k = min(args.k, index.count())
+    positions, _ = index.search(queries, k)
+    exact_ids = [{index.ids[p] for p in row} for row in positions]
+    print(f"\n{index.count()} vectors, {len(queries)} queries, recall@{k} against exact search\n")
+
+    results = []
+    width = max(len("profile"), *map(len, profiles))
+    print(f"  {'profile':<{width}} {'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'build s':>8}")
+    with tempfile.TemporaryDirectory(prefix="stayeasy-sweep-") as work_dir:
+        for spec in profiles:
+            result = measure_profile(spec, index, queries, exact_ids, k, work_dir)
+            results.append(result)
+            print(f"  {spec:<{width}} {result[f'recall_at_{k}']:>9.1%} {result['query_ms']['p50']:>8.3f} "
+                  f"{result['query_ms']['p95']:>8.3f} {result['query_ms']['p99']:>8.3f} {result['build_seconds']:>8.2f}")
+
+    good = [result for result in results if result[f"recall_at_{k}"] >= args.min_recall]
+    if good:
+        best = min(good, key=lambda result: result["query_ms"]["p95"])
+        print(f"\n  Fastest profile with recall@{k} >= {args.min_recall:.0%}: {best['profile']}")
+        print(f"  Apply it with: python ingest.py --index-profile \"{best['profile']}\"")
+    else:
+        print(f"\n  No profile reached recall@{k} >= {args.min_recall:.0%}; try a higher search_ef")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+            "vectors": index.count(),
+            "source": f"synthetic ({args.synthetic_docs} docs)" if args.synthetic_docs else ingest.CHROMA_PATH,
+            "k": k,
+            "min_recall": args.min_recall,
+            "results": results,
+        }, f, indent=2)
+    print(f"\n  Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()